@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'richman.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -97,6 +98,46 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Версии кеша ответов, пользователи JWT, отозванные токены и счетчики лимитов живут в кеше, поэтому при нескольких
+# процессах (воркеры gunicorn, send_emails) кеш должен быть общим: REDIS_URL=redis://redis:6379/1.
+# LocMemCache у каждого процесса свой — годится только для локальной разработки и тестов
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'richman',
+        }
+    }
+
+
+# Профилирование запросов (richman/middleware.py): доля запросов с заголовком Server-Timing,
+# 0 — middleware отключено. Запросы дольше порога пишутся в лог richman.slow_requests вместе с SQL
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_SLOW_REQUEST_MS = int(os.getenv('PROFILING_SLOW_REQUEST_MS', '500'))
+PROFILING_SLOW_SQL_LIMIT = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'richman': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -146,7 +187,7 @@ AUTH_USER_MODEL = 'richman.UserProfile'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'richman.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -156,13 +197,32 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    # лимиты на вход, регистрацию и сброс пароля (richman.throttling): '<scope>' — на IP, '<scope>_account' — на
+    # логин/email из запроса. Счетчики в кеше: при нескольких процессах нужен общий кеш (Redis/Memcached)
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '20/min',
+        'login_account': '5/min',
+        'register': '10/hour',
+        'password_reset': '10/hour',
+        'password_reset_account': '3/hour',
+        'verify_reset_code': '20/hour',
+        'verify_reset_code_account': '10/hour',
+    },
+    # сколько прокси перед Django: nginx/nginx.conf дописывает адрес клиента в конец X-Forwarded-For, берем его,
+    # а не то, что клиент прислал сам. Без прокси (runserver) — NUM_PROXIES=0
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '1')),
 }
 
+# неверных вводов кода сброса, после которых код сгорает и нужно запросить новый
+PASSWORD_RESET_MAX_ATTEMPTS = 5
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=15),
     "ROTATE_REFRESH_TOKENS": True,
     "AUTH_HEADER_TYPES": ('Bearer',),
+    # отозванные токены (выход, ротация) хранятся в richman.RevokedToken с кешем перед ним
+    "TOKEN_REFRESH_SERIALIZER": 'richman.serializers.TokenRefreshSerializer',
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -17,3 +17,5 @@ admin.site.register(Group)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(History)
 admin.site.register(HistoryItem)
+admin.site.register(OutgoingEmail)
+admin.site.register(RevokedToken)
@@ -0,0 +1,45 @@
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .cache import get_version
+from .tokens import is_issued_before_revocation, is_revoked
+
+
+def user_cache_key(user_id):
+    # версию 'user' поднимает сигнал на сохранение/удаление UserProfile (смена пароля, деактивация)
+    return f'richman:user:{user_id}:{get_version("user", user_id)}'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWTAuthentication, которая берет пользователя из кеша, а не SELECT'ом на каждый запрос """
+    cache_timeout = 5 * 60
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        # access-токен после выхода: проверяем только по кешу, без запроса в базу на каждый вызов API
+        if is_revoked(token, durable=False):
+            raise InvalidToken(_('Token is invalid or expired'))
+        return token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            # в кеш попадает только пользователь, прошедший все проверки
+            user = super().get_user(validated_token)
+            cache.set(key, user, self.cache_timeout)
+        elif api_settings.CHECK_REVOKE_TOKEN and \
+                validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        # отметку в кеше по jti могли вытеснить, отметка о выходе приходит вместе с пользователем
+        if is_issued_before_revocation(validated_token, user):
+            raise InvalidToken(_('Token is invalid or expired'))
+        return user
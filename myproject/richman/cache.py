@@ -0,0 +1,132 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def version_key(scope, owner_id):
+    return f'richman:version:{scope}:{owner_id}'
+
+
+def get_version(scope, owner_id):
+    """ Версия данных владельца: входит в ключи кеша, поэтому смена версии инвалидирует их все сразу """
+    # если счетчик вытеснили из кеша, новая версия по времени не совпадет ни с одной старой
+    return cache.get_or_set(version_key(scope, owner_id), time.time_ns, None)
+
+
+def incr_version(scope, owner_id):
+    try:
+        cache.incr(version_key(scope, owner_id))
+    except ValueError:
+        cache.set(version_key(scope, owner_id), time.time_ns(), None)
+
+
+def bump_version(scope, owner_id):
+    """ Поднимаем сразу и еще раз после коммита: пока транзакция открыта, параллельный GET еще видит старые
+    строки и мог закешировать их под уже новой версией — второй подъем такой ответ отбрасывает """
+    incr_version(scope, owner_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: incr_version(scope, owner_id))
+
+
+def bump_owner_versions(owner_id, *scopes):
+    if owner_id is None:
+        return
+    for scope in scopes:
+        bump_version(scope, owner_id)
+
+
+def get_owner_id(model, pk, owner_field):
+    """ Владелец группы/истории не меняется, поэтому запоминаем его навсегда и не ходим в базу в сигналах """
+    key = f'richman:owner:{model._meta.model_name}:{pk}'
+    owner_id = cache.get(key)
+    if owner_id is None:
+        owner_id = model.objects.filter(pk=pk).values_list(owner_field, flat=True).first()
+        if owner_id is not None:
+            cache.set(key, owner_id, None)
+    return owner_id
+
+
+def count_cache_request(view_name, hit):
+    key = f'richman:stats:{view_name}:{"hits" if hit else "misses"}'
+    cache.add(key, 0, None)
+    cache.incr(key)
+
+
+def get_cache_stats(view_names):
+    stats = {}
+    for view_name in view_names:
+        hits = cache.get(f'richman:stats:{view_name}:hits', 0)
+        misses = cache.get(f'richman:stats:{view_name}:misses', 0)
+        total = hits + misses
+        stats[view_name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 3) if total else None}
+    return stats
+
+
+class CachedResponseMixin:
+    """ Кеширует успешный GET-ответ на пользователя и параметры запроса.
+    В ключ входят версии cache_scopes владельца, их поднимают сигналы при изменении данных """
+    cache_scopes = ()
+    cache_timeout = 60 * 60
+    cached_views = set()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.cache_scopes:
+            CachedResponseMixin.cached_views.add(cls.__name__)
+
+    def get_cache_key(self, request):
+        owner_id = request.user.id
+        versions = ':'.join(str(get_version(scope, owner_id)) for scope in self.cache_scopes)
+        params = urlencode(sorted(self.kwargs.items())) + '?' + urlencode(sorted(request.query_params.items()))
+        digest = hashlib.md5(params.encode()).hexdigest()
+        return f'richman:response:{type(self).__name__}:{owner_id}:{versions}:{digest}'
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+
+        cache_key = self.get_cache_key(request)
+        data = cache.get(cache_key)
+        count_cache_request(type(self).__name__, hit=data is not None)
+        if data is not None:
+            return Response(data)
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data, self.cache_timeout)
+        return response
+
+
+class ConditionalGetMixin:
+    """ ETag/Last-Modified для GET: состояние ресурса берется одним дешевым запросом (get_last_modified),
+    и если клиент уже видел его (If-None-Match), отвечаем 304 без сериализации """
+
+    def get_last_modified(self, request):
+        """ (updated_date, доп. данные для ETag) или None, если ресурс недоступен пользователю """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        state = self.get_last_modified(request) if request.user.is_authenticated else None
+        if state is None or state[0] is None:
+            # нет доступа или данных: обычный путь ответит 403/404 или пустым списком
+            return super().get(request, *args, **kwargs)
+
+        last_modified, extra = state
+        params = urlencode(sorted(request.query_params.items()))
+        raw = f'{type(self).__name__}:{request.user.id}:{last_modified.isoformat()}:{extra}:{params}'
+        etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+        # 304 отдаем только по If-None-Match: Last-Modified с точностью до секунды, и изменение в ту же секунду,
+        # что и прошлый GET клиента, по If-Modified-Since не было бы видно
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
@@ -0,0 +1,29 @@
+from django.db import connections
+from django.db.models.sql import UpdateQuery
+
+
+def supports_update_returning(connection):
+    """ UPDATE ... RETURNING есть в PostgreSQL и в SQLite с 3.35; Django 5.1 работает и с SQLite 3.31+ """
+    # у MariaDB can_return_columns_from_insert тоже True, но RETURNING там есть только у INSERT/DELETE
+    return connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert
+
+
+def update_returning_pks(queryset, **values):
+    """ queryset.update(), который возвращает pk измененных строк """
+    connection = connections[queryset.db]
+    if not supports_update_returning(connection):
+        # без RETURNING сравниваем-и-записываем по одной строке: медленнее, но так же точно
+        return [
+            pk for pk in list(queryset.values_list('pk', flat=True))
+            if queryset.filter(pk=pk).update(**values)
+        ]
+
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    sql, params = query.get_compiler(queryset.db).as_sql()
+    if not sql:
+        return []
+    pk_column = connection.ops.quote_name(queryset.model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {pk_column}', params)
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,54 @@
+import csv
+import tempfile
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from rest_framework import exceptions
+
+EXPORT_TYPES = ('csv', 'xlsx')
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """ csv.writer пишет строку сюда и сразу получает ее обратно, чтобы отдать в поток """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    # BOM, чтобы Excel открыл кириллицу в UTF-8 без мастера импорта
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def build_xlsx(header, rows, title):
+    """ write_only-книга держит в памяти одну строку, остальное пишет во временный файл """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    file = tempfile.TemporaryFile()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+def get_export_type(request):
+    export_type = request.query_params.get('type', 'csv')
+    if export_type not in EXPORT_TYPES:
+        raise exceptions.ValidationError({'type': f'Допустимые значения: {", ".join(EXPORT_TYPES)}.'})
+    return export_type
+
+
+def export_response(export_type, filename, header, rows, title):
+    """ rows — генератор по .iterator(), поэтому память не растет вместе с количеством строк """
+    filename = f'{filename}-{timezone.localdate():%Y-%m-%d}.{export_type}'
+    if export_type == 'xlsx':
+        return FileResponse(build_xlsx(header, rows, title), as_attachment=True, filename=filename)
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -1,11 +1,99 @@
-from django_filters import FilterSet, DateFilter
+from datetime import datetime, time, timedelta
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django_filters import BaseInFilter, BooleanFilter, CharFilter, FilterSet, DateFilter, NumberFilter
 from .models import *
 
 
+def start_of_day(value):
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
 class SalesHistoryFilter(FilterSet):
-    sold_date__gte = DateFilter(field_name='sold_date', lookup_expr='gte', label='Sold after or on')
-    sold_date__lte = DateFilter(field_name='sold_date', lookup_expr='lte', label='Sold before or on')
+    # границы считаются по локальным суткам, а сравнение идет по самому sold_date, чтобы работал индекс
+    sold_date__gte = DateFilter(method='filter_sold_after', label='Sold after or on')
+    sold_date__lte = DateFilter(method='filter_sold_before', label='Sold before or on')
+    seller = NumberFilter(field_name='product_size__seller')
+    size = NumberFilter(field_name='product_size__size')
 
     class Meta:
         model = HistoryItem
-        fields = ['sold_date__gte', 'sold_date__lte']
+        fields = ['sold_date__gte', 'sold_date__lte', 'seller', 'size']
+
+    def filter_sold_after(self, queryset, name, value):
+        return queryset.filter(sold_date__gte=start_of_day(value))
+
+    def filter_sold_before(self, queryset, name, value):
+        return queryset.filter(sold_date__lt=start_of_day(value + timedelta(days=1)))
+
+
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
+
+
+class GroupFilter(FilterSet):
+    """ Все условия проверяются одним Exists() по продуктам/размерам группы: без join'ов в основном
+    запросе и без .distinct(), поэтому стоимость не зависит от числа групп и размеров """
+    size = NumberInFilter(label='Размеры через запятую: 38,39,40 (по умолчанию в наличии)')
+    have = BooleanFilter(label='В наличии')
+    price_min = NumberFilter(label='low_price от')
+    price_max = NumberFilter(label='low_price до')
+    search = CharFilter(label='Название продукта')
+    # старые имена параметров
+    products__sizes__size = NumberInFilter(label='То же, что size')
+    products__sizes__have = BooleanFilter(label='То же, что have')
+
+    class Meta:
+        model = Group
+        fields = ['size', 'have', 'price_min', 'price_max', 'search']
+
+    def filter_queryset(self, queryset):
+        data = self.form.cleaned_data
+        sizes = data.get('size') or data.get('products__sizes__size')
+        have = data.get('have')
+        if have is None:
+            have = data.get('products__sizes__have')
+
+        product = {}
+        if data.get('price_min') is not None:
+            product['low_price__gte'] = data['price_min']
+        if data.get('price_max') is not None:
+            product['low_price__lte'] = data['price_max']
+        if data.get('search'):
+            product['product_name__icontains'] = data['search']
+
+        if sizes or have is not None:
+            size = {'product__group': OuterRef('pk')}
+            if sizes:
+                size['size__in'] = sizes
+                # размер ищут, чтобы продать: по умолчанию только те, что в наличии
+                have = True if have is None else have
+            size['have'] = have
+            # условия по продукту относятся к тому же продукту, у которого нашелся размер
+            size.update({f'product__{lookup}': value for lookup, value in product.items()})
+            return queryset.filter(Exists(ProductSize.objects.filter(**size)))
+        if product:
+            return queryset.filter(Exists(Product.objects.filter(group=OuterRef('pk'), **product)))
+        return queryset
+
+
+class GroupReportFilter(GroupFilter):
+    group_date__gte = DateFilter(field_name='group_date', lookup_expr='gte')
+    group_date__lte = DateFilter(field_name='group_date', lookup_expr='lte')
+
+    class Meta(GroupFilter.Meta):
+        fields = GroupFilter.Meta.fields + ['group_date__gte', 'group_date__lte']
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        for name in ('group_date__gte', 'group_date__lte'):
+            queryset = self.filters[name].filter(queryset, self.form.cleaned_data.get(name))
+        return queryset
+
+
+class InventoryFilter(FilterSet):
+    size = NumberInFilter(field_name='size', label='Размеры через запятую: 40,41')
+
+    class Meta:
+        model = ProductSize
+        fields = ['size']
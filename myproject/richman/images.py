@@ -0,0 +1,82 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .cache import bump_owner_versions, get_owner_id
+from .models import Group, Product
+from .rollups import apply_delta
+
+logger = logging.getLogger(__name__)
+
+# имя -> максимальные ширина и высота, пропорции сохраняются
+THUMBNAIL_SIZES = {
+    'small': (200, 200),
+    'medium': (600, 600),
+}
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+
+
+def thumbnail_path(image_name, size_name, extension):
+    directory, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'thumbs', f'{stem}_{size_name}.{extension}')
+
+
+def build_thumbnails(product):
+    """ Режет product.image на превью THUMBNAIL_SIZES в WebP и JPEG и сохраняет пути в product.thumbnails """
+    image_name = product.image.name
+    with default_storage.open(image_name, 'rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGB')
+
+    thumbnails = {}
+    for size_name, size in THUMBNAIL_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(size, Image.LANCZOS)
+        thumbnails[size_name] = {}
+        for extension, (image_format, options) in THUMBNAIL_FORMATS.items():
+            buffer = BytesIO()
+            thumbnail.save(buffer, image_format, **options)
+            path = thumbnail_path(image_name, size_name, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            thumbnails[size_name][extension] = default_storage.save(path, ContentFile(buffer.getvalue()))
+
+    # если за это время загрузили другое изображение, его превью сделает уже следующая задача
+    updated = Product.objects.filter(pk=product.pk, image=image_name).update(
+        thumbnails=thumbnails, updated_date=timezone.now()
+    )
+    if updated:
+        # update() идет в обход сигналов, поэтому группу и кеш ответов обновляем сами
+        apply_delta(Group, product.group_id, {})
+        bump_owner_versions(get_owner_id(Group, product.group_id, 'owner_id'), 'groups')
+    product.thumbnails = thumbnails
+    return thumbnails
+
+
+def build_thumbnails_in_background(product_id):
+    try:
+        product = Product.objects.filter(pk=product_id).only('image', 'group_id').first()
+        if product and product.image:
+            build_thumbnails(product)
+    except Exception:
+        logger.exception('Не удалось сделать превью для продукта %s', product_id)
+    finally:
+        # у потока свое соединение с базой, не оставляем его висеть
+        connections.close_all()
+
+
+def schedule_thumbnails(product):
+    """ Превью делаются в пуле потоков после коммита, чтобы не задерживать запрос на загрузку """
+    product_id = product.pk
+    transaction.on_commit(lambda: executor.submit(build_thumbnails_in_background, product_id))
@@ -0,0 +1,149 @@
+import csv
+import io
+import os
+import re
+from django.db import transaction
+from openpyxl import load_workbook
+from .cache import bump_owner_versions
+from .models import Group, Product, ProductSize
+from .rollups import apply_delta, size_contribution
+from .search import index_products
+from .serializers import ProductSerializer, ProductSizeBulkListSerializer, ProductSizeSerializer
+
+COLUMNS = ('product_name', 'article', 'low_price', 'sizes', 'description')
+REQUIRED_COLUMNS = ('product_name', 'low_price', 'sizes')
+CHUNK_SIZE = 500
+
+
+class ImportFileError(Exception):
+    """ Файл нельзя импортировать: формат, заголовок или ошибки в строках (rows — {номер строки: ошибки}) """
+
+    def __init__(self, message, rows=None):
+        super().__init__(message)
+        self.rows = rows or {}
+
+    def as_data(self):
+        data = {'detail': str(self)}
+        if self.rows:
+            data['rows'] = [{'row': row, 'errors': errors} for row, errors in sorted(self.rows.items())]
+        return data
+
+
+def read_rows(file, filename):
+    """ Строки файла как (номер строки, dict по заголовку); номер — как в Excel, заголовок — строка 1 """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        sheet = load_workbook(file, read_only=True, data_only=True).active
+        rows = (['' if value is None else str(value) for value in row] for row in sheet.iter_rows(values_only=True))
+    elif extension in ('.csv', '.txt'):
+        data = file.read()
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            # Excel с русской локалью сохраняет CSV в cp1251 и через ';'
+            text = data.decode('cp1251')
+        sample = text[:4096]
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(io.StringIO(text, newline=''), dialect)
+    else:
+        raise ImportFileError('Поддерживаются файлы .csv и .xlsx.')
+
+    header = [name.strip().lower() for name in next(rows, [])]
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise ImportFileError(f'В заголовке нет столбцов: {", ".join(missing)}. Ожидаются: {", ".join(COLUMNS)}.')
+    for number, row in enumerate(rows, start=2):
+        if any(value.strip() for value in row):
+            yield number, {name: value.strip() for name, value in zip(header, row) if name in COLUMNS}
+
+
+def parse_sizes(value):
+    """ '38, 39, 39, 40' или '38 39x2 40' -> [(размер, количество)]; xN — несколько одинаковых размеров """
+    sizes = []
+    for part in re.split(r'[,;\s]+', value.strip()):
+        if part:
+            size, _, quantity = part.lower().replace('*', 'x').partition('x')
+            sizes.append((size, quantity or '1'))
+    return sizes
+
+
+def validate_rows(rows, max_rows=None):
+    """ Проверяет все строки за один проход теми же сериализаторами, что и /product/create/ и /size/create/.
+    Возвращает [(данные продукта, размеры)] или бросает ImportFileError со списком ошибок по строкам """
+    products, errors, valid_sizes = [], {}, {}
+    for number, row in rows:
+        if max_rows and len(products) + len(errors) >= max_rows:
+            raise ImportFileError(f'В файле больше {max_rows} строк, разбейте его на части.')
+
+        row_errors = {}
+        serializer = ProductSerializer(data={name: row.get(name) or None for name in COLUMNS if name != 'sizes'})
+        if not serializer.is_valid():
+            row_errors.update(serializer.errors)
+
+        sizes = []
+        for size, quantity in parse_sizes(row.get('sizes', '')):
+            if size not in valid_sizes:
+                size_serializer = ProductSizeSerializer(data={'size': size})
+                valid_sizes[size] = size_serializer.validated_data['size'] if size_serializer.is_valid() else None
+            if valid_sizes[size] is None or not quantity.isdigit() or int(quantity) < 1:
+                row_errors.setdefault('sizes', []).append(f'Неверный размер: {size}x{quantity}')
+            elif len(sizes) + int(quantity) > ProductSizeBulkListSerializer.max_sizes:
+                row_errors.setdefault('sizes', []).append(
+                    f'Не больше {ProductSizeBulkListSerializer.max_sizes} размеров у одного продукта.'
+                )
+                break
+            else:
+                sizes.extend([valid_sizes[size]] * int(quantity))
+        if not sizes and 'sizes' not in row_errors:
+            row_errors['sizes'] = ['Укажите хотя бы один размер.']
+
+        if row_errors:
+            errors[number] = row_errors
+        else:
+            products.append((serializer.validated_data, sizes))
+
+    if errors:
+        raise ImportFileError(f'Ошибки в строках: {len(errors)}. Ничего не импортировано.', errors)
+    if not products:
+        raise ImportFileError('В файле нет строк с продуктами.')
+    return products
+
+
+def import_products(group, products, chunk_size=CHUNK_SIZE, progress=None):
+    """ Создает продукты и размеры через bulk_create пачками в одной транзакции.
+    Сигналы при этом не срабатывают, поэтому итоги, индекс поиска и версии кеша обновляем сами """
+    group_delta = {'products_count': 0}
+    created = sizes_created = 0
+    with transaction.atomic():
+        for start in range(0, len(products), chunk_size):
+            chunk = products[start:start + chunk_size]
+            instances = []
+            for data, sizes in chunk:
+                # все размеры новые и в наличии: итоги продукта известны до вставки
+                product = Product(group=group, **data)
+                for field, value in size_contribution(True, None, product.low_price).items():
+                    setattr(product, field, value * len(sizes))
+                instances.append(product)
+            Product.objects.bulk_create(instances)
+            ProductSize.objects.bulk_create(
+                [ProductSize(product=product, size=size) for product, (data, sizes) in zip(instances, chunk)
+                 for size in sizes],
+                batch_size=chunk_size,
+            )
+            index_products(instances, owner_id=group.owner_id)
+
+            group_delta['products_count'] += len(instances)
+            for product in instances:
+                for field in Product.rollup_fields:
+                    group_delta[field] = group_delta.get(field, 0) + getattr(product, field)
+            created += len(instances)
+            sizes_created += sum(len(sizes) for data, sizes in chunk)
+            if progress:
+                progress(created, len(products))
+
+        apply_delta(Group, group.pk, group_delta)
+    bump_owner_versions(group.owner_id, 'groups')
+    return {'products': created, 'sizes': sizes_created}
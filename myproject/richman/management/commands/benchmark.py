@@ -0,0 +1,125 @@
+import json
+import math
+import statistics
+import time
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from richman.models import Group, Product, UserProfile
+
+# название замера -> (имя url из richman/urls.py, kwargs, параметры запроса);
+# в kwargs подставляются id данных пользователя
+ENDPOINTS = {
+    'group_list': ('group_list', {}, {}),
+    'group_list_filtered': ('group_list', {}, {'size': '40,41', 'search': 'Кроссовки'}),
+    'group_detail': ('group_detail', {'pk': 'group'}, {}),
+    'product_detail': ('product_edit', {'pk': 'product'}, {}),
+    'product_search': ('product_search', {}, {'q': 'кросс'}),
+    'seller_list': ('seller_list', {}, {}),
+    'history': ('history_list', {}, {}),
+    'history_items': ('history_item_list', {}, {}),
+    'inventory': ('inventory', {}, {}),
+    'sales_analytics': ('sales_analytics', {}, {'period': 'week'}),
+}
+
+
+def percentile(values, percent):
+    """ Перцентиль методом ближайшего ранга """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет GET-запросы к endpoint\'ам из richman/urls.py через тестовый клиент с настоящим JWT '
+            'и печатает p50/p95/p99, число запросов к базе и размер ответа в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Имя пользователя (по умолчанию — у кого больше всего групп)')
+        parser.add_argument('--requests', type=int, default=50, help='Запросов на endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='Запросов перед замером (не считаются)')
+        parser.add_argument('--cold', action='store_true', help='Чистить кеш перед каждым запросом')
+        parser.add_argument('--endpoint', action='append', choices=sorted(ENDPOINTS),
+                            help='Только эти endpoint\'ы (можно несколько раз)')
+        parser.add_argument('--output', help='Записать JSON в файл вместо stdout')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        ids = {
+            'group': Group.objects.filter(owner=user).order_by('-group_date').values_list('pk', flat=True).first(),
+            'product': Product.objects.filter(group__owner=user).order_by('-pk').values_list('pk', flat=True).first(),
+        }
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+        results = {}
+        for name in options['endpoint'] or ENDPOINTS:
+            url_name, kwargs, params = ENDPOINTS[name]
+            if any(ids[value] is None for value in kwargs.values()):
+                self.stderr.write(f'{name}: у пользователя нет данных, пропускаем')
+                continue
+            url = reverse(url_name, kwargs={key: ids[value] for key, value in kwargs.items()})
+            results[name] = self.measure(client, url, params, options)
+
+        report = {
+            'user': user.username,
+            'requests': options['requests'],
+            'cold': options['cold'],
+            'data': {
+                'groups': Group.objects.filter(owner=user).count(),
+                'products': Product.objects.filter(group__owner=user).count(),
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Результат записан в {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+    def get_user(self, username):
+        if username:
+            user = UserProfile.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f'Пользователь {username} не найден')
+            return user
+        user = UserProfile.objects.annotate(group_count=Count('groups_owner')).filter(group_count__gt=0) \
+            .order_by('-group_count').first()
+        if user is None:
+            raise CommandError('Нет пользователей с данными, сначала запустите generate_data')
+        return user
+
+    def measure(self, client, url, params, options):
+        for _ in range(options['warmup']):
+            client.get(url, params)
+
+        timings, queries, sizes, statuses = [], [], [], set()
+        for _ in range(options['requests']):
+            if options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(url, params)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context))
+            sizes.append(len(content))
+            statuses.add(response.status_code)
+
+        return {
+            'url': url,
+            'params': params,
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.mean(timings), 2),
+            'queries_max': max(queries),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'bytes': max(sizes),
+        }
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from richman.images import build_thumbnails
+from richman.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Делает превью (WebP и JPEG) для изображений продуктов, у которых их еще нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Пересоздать превью и для продуктов, где они уже есть')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('image', 'group_id')
+        if not options['all']:
+            products = products.filter(thumbnails={})
+
+        done = failed = 0
+        for product in products.order_by('pk').iterator(chunk_size=100):
+            try:
+                build_thumbnails(product)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Продукт #{product.pk} ({product.image.name}): {error}')
+            else:
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f'Превью готовы: {done}, с ошибкой: {failed}'))
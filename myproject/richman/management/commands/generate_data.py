@@ -0,0 +1,139 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from richman.models import Group, History, HistoryItem, Product, ProductSize, Seller, UserProfile
+from richman.rollups import size_contribution
+from richman.search import index_products
+
+PRODUCT_NAMES = ['Кроссовки', 'Ботинки', 'Кеды', 'Туфли', 'Сапоги', 'Сандалии', 'Мокасины', 'Слипоны']
+BRANDS = ['Nike', 'Adidas', 'Puma', 'Reebok', 'New Balance', 'Asics', 'Vans', 'Converse']
+SELLER_NAMES = ['Айбек', 'Нурлан', 'Айгуль', 'Бакыт', 'Жылдыз', 'Эрлан', 'Алина', 'Тимур']
+SIZES = range(36, 46)
+
+
+class Command(BaseCommand):
+    help = 'Создает тестовые аккаунты с группами, продуктами, размерами, продавцами и продажами (через bulk_create)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--groups', type=int, default=30, help='Групп на пользователя')
+        parser.add_argument('--products', type=int, default=20, help='Продуктов в группе')
+        parser.add_argument('--sizes', type=int, default=10, help='Размеров у продукта')
+        parser.add_argument('--sellers', type=int, default=5, help='Продавцов на пользователя')
+        parser.add_argument('--sold', type=float, default=0.5, help='Доля проданных размеров, от 0 до 1')
+        parser.add_argument('--days', type=int, default=90, help='Продажи распределяются по последним N дням')
+        parser.add_argument('--prefix', default='bench', help='Префикс имен пользователей')
+        parser.add_argument('--password', default='bench-pass-123')
+        parser.add_argument('--seed', type=int, default=None, help='Для одинаковых данных между запусками')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['sold'] <= 1:
+            raise CommandError('--sold должен быть от 0 до 1')
+        taken = UserProfile.objects.filter(username__startswith=options['prefix']).values_list('username', flat=True)
+        start = len(taken)
+        usernames = [f'{options["prefix"]}{number}' for number in range(start, start + options['users'])]
+        if set(usernames) & set(taken):
+            raise CommandError(f'Пользователи с префиксом {options["prefix"]} уже есть, укажите другой --prefix')
+
+        self.random = random.Random(options['seed'])
+        self.options = options
+        self.rows = defaultdict(int)
+        started = time.perf_counter()
+
+        # хеш пароля считается долго, поэтому один на всех
+        password = make_password(options['password'])
+        users = UserProfile.objects.bulk_create([
+            UserProfile(username=username, email=f'{username}@example.com', first_name=username, password=password)
+            for username in usernames
+        ])
+        self.rows['users'] += len(users)
+        for user in users:
+            # новые пользователи: в кеше ответов для них ничего нет, версии поднимать не нужно
+            with transaction.atomic():
+                self.generate_account(user)
+
+        seconds = time.perf_counter() - started
+        summary = ', '.join(f'{name}: {count}' for name, count in self.rows.items())
+        self.stdout.write(self.style.SUCCESS(f'Создано за {seconds:.1f} с — {summary}'))
+        self.stdout.write(f'Пароль пользователей: {options["password"]}')
+
+    def generate_account(self, user):
+        options, rng, batch_size = self.options, self.random, self.options['batch_size']
+
+        sellers = Seller.objects.bulk_create([
+            Seller(owner=user, seller_name=f'{rng.choice(SELLER_NAMES)} {number}') for number in range(options['sellers'])
+        ], batch_size=batch_size)
+        history = History.objects.create(user=user)
+
+        groups = Group.objects.bulk_create([
+            Group(owner=user, group_date=date.today() - timedelta(days=number)) for number in range(options['groups'])
+        ], batch_size=batch_size)
+
+        # размеры генерируем до вставки, чтобы сразу записать итоги продуктов и групп (сигналы не сработают)
+        products, product_sizes = [], []
+        for group in groups:
+            for number in range(options['products']):
+                low_price = rng.randrange(500, 5000, 100)
+                product = Product(
+                    group=group, low_price=low_price,
+                    product_name=f'{rng.choice(PRODUCT_NAMES)} {rng.choice(BRANDS)} {number}',
+                    article=f'{rng.choice(BRANDS)[:2].upper()}-{rng.randrange(1000, 9999)}',
+                    description=rng.choice([None, 'Натуральная кожа', 'Текстиль, на лето', 'Зимние, с мехом']),
+                )
+                sizes = []
+                for size in rng.choices(SIZES, k=options['sizes']):
+                    sold = rng.random() < options['sold']
+                    sizes.append(ProductSize(
+                        size=size, have=not sold,
+                        high_price=int(low_price * rng.uniform(1.1, 1.8)) if sold else None,
+                        seller=rng.choice(sellers) if sold and sellers else None,
+                    ))
+                for size in sizes:
+                    for field, value in size_contribution(size.have, size.high_price, low_price).items():
+                        setattr(product, field, getattr(product, field) + value)
+                products.append(product)
+                product_sizes.append(sizes)
+
+        for product in products:
+            product.group.products_count += 1
+            for field in Product.rollup_fields:
+                setattr(product.group, field, getattr(product.group, field) + getattr(product, field))
+        Group.objects.bulk_update(groups, Group.rollup_fields, batch_size=batch_size)
+        Product.objects.bulk_create(products, batch_size=batch_size)
+        index_products(products, owner_id=user.pk)
+
+        for product, sizes in zip(products, product_sizes):
+            for size in sizes:
+                size.product = product
+        sizes = ProductSize.objects.bulk_create([size for sizes in product_sizes for size in sizes],
+                                                batch_size=batch_size)
+
+        sold = [size for size in sizes if not size.have]
+        items = HistoryItem.objects.bulk_create([
+            HistoryItem(history=history, product_id=size.product_id, product_size=size) for size in sold
+        ], batch_size=batch_size)
+        self.spread_sales(items)
+
+        self.rows['sellers'] += len(sellers)
+        self.rows['groups'] += len(groups)
+        self.rows['products'] += len(products)
+        self.rows['sizes'] += len(sizes)
+        self.rows['sales'] += len(items)
+
+    def spread_sales(self, items):
+        """ sold_date заполняется auto_now(_add) текущим временем; раскидываем продажи по дням одним UPDATE на день """
+        days = defaultdict(list)
+        for item in items:
+            days[self.random.randrange(self.options['days'] or 1)].append(item)
+        today = timezone.localdate()
+        for day, day_items in days.items():
+            sold_date = timezone.make_aware(datetime.combine(today - timedelta(days=day), datetime.min.time()))
+            sold_date += timedelta(minutes=self.random.randrange(9 * 60, 21 * 60))
+            HistoryItem.objects.filter(pk__in=[item.pk for item in day_items]).update(sold_date=sold_date)
+            ProductSize.objects.filter(pk__in=[item.product_size_id for item in day_items]).update(sold_date=sold_date)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from richman.imports import CHUNK_SIZE, ImportFileError, import_products, read_rows, validate_rows
+from richman.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Импортирует продукты и размеры в группу из CSV/XLSX (столбцы product_name, article, low_price, sizes, ' \
+           'description)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('group_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл')
+
+    def handle(self, *args, **options):
+        group = Group.objects.filter(pk=options['group_id']).first()
+        if group is None:
+            raise CommandError(f'Группа #{options["group_id"]} не найдена')
+
+        try:
+            with open(options['path'], 'rb') as file:
+                products = validate_rows(read_rows(file, options['path']))
+        except ImportFileError as error:
+            for row, errors in sorted(error.rows.items()):
+                self.stderr.write(f'Строка {row}: ' + '; '.join(
+                    f'{field}: {" ".join(str(message) for message in messages)}' for field, messages in errors.items()
+                ))
+            raise CommandError(str(error))
+
+        self.stdout.write(f'Файл в порядке: продуктов {len(products)}')
+        if options['dry_run']:
+            return
+
+        def progress(done, total):
+            self.stdout.write(f'  {done}/{total}')
+
+        result = import_products(group, products, chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Импортировано продуктов: {result["products"]}, размеров: {result["sizes"]}'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from richman.tokens import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Удаляет отозванные токены, срок жизни которых уже истек (запускать периодически, например раз в сутки)'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Удалено истекших токенов: {purge_expired_tokens()}'))
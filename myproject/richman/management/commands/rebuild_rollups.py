@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from richman.cache import bump_owner_versions
+from richman.models import Group, Product
+
+
+# поле итогов -> как получить его значение из аннотаций with_totals()
+PRODUCT_TOTALS = {
+    'sold_count': lambda obj: obj.count_sold_sizes,
+    'stock_count': lambda obj: obj.count_all_sizes - obj.count_sold_sizes,
+    'spend': lambda obj: obj.products_spend,
+    'income': lambda obj: obj.products_income,
+    'profit': lambda obj: obj.products_profit,
+}
+
+GROUP_TOTALS = {
+    'products_count': lambda obj: obj.count_products,
+    'sold_count': lambda obj: obj.count_sold_sizes,
+    'stock_count': lambda obj: obj.count_all_sizes - obj.count_sold_sizes,
+    'spend': lambda obj: obj.group_spend,
+    'income': lambda obj: obj.products_income,
+    'profit': lambda obj: obj.products_profit,
+}
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги продуктов и групп по таблице размеров и проверяет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только найти расхождения, ничего не записывая (код выхода 1, если они есть)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        check = options['check']
+        batch_size = options['batch_size']
+        drift = 0
+        # исправленные итоги должны дойти до клиентов: двигаем updated_date (ETag) и версии кеша владельцев
+        now = timezone.now()
+        owner_ids = set()
+
+        for model, totals in ((Product, PRODUCT_TOTALS), (Group, GROUP_TOTALS)):
+            drifted = []
+            queryset = model.objects.with_totals().order_by('pk')
+            for obj in queryset.iterator(chunk_size=batch_size):
+                actual = {field: value(obj) for field, value in totals.items()}
+                changed = {field: value for field, value in actual.items() if getattr(obj, field) != value}
+                if not changed:
+                    continue
+                if check:
+                    self.stdout.write(f'{model.__name__} #{obj.pk}: ' + ', '.join(
+                        f'{field} {getattr(obj, field)} != {value}' for field, value in changed.items()
+                    ))
+                for field, value in actual.items():
+                    setattr(obj, field, value)
+                obj.updated_date = now
+                drifted.append(obj)
+
+            drift += len(drifted)
+            if drifted and not check:
+                with transaction.atomic():
+                    model.objects.bulk_update(drifted, list(totals) + ['updated_date'], batch_size=batch_size)
+                    if model is Product:
+                        # итоги продуктов видны и в группе: /group/<pk>/ отдает их вместе с ETag группы
+                        groups = Group.objects.filter(pk__in={obj.group_id for obj in drifted})
+                        groups.update(updated_date=now)
+                        owner_ids.update(groups.values_list('owner_id', flat=True))
+                    else:
+                        owner_ids.update(obj.owner_id for obj in drifted)
+            self.stdout.write(f'{model.__name__}: расхождений {len(drifted)}')
+
+        for owner_id in owner_ids:
+            bump_owner_versions(owner_id, 'groups', 'history')
+
+        if check and drift:
+            raise CommandError(f'Итоги расходятся с таблицей размеров: {drift}')
+        self.stdout.write(self.style.SUCCESS('Итоги в порядке' if check else 'Итоги пересчитаны'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from richman.search import is_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет FTS5-индекс поиска продуктов (название, артикул, описание)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not is_available():
+            self.stdout.write('Полнотекстовый индекс есть только на SQLite, здесь поиск идет через LIKE')
+            return
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано продуктов: {count}'))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from richman.outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди OutgoingEmail пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза в секундах, когда очередь пуста')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Отправлено: {sent}, с ошибкой: {failed}')
+            if not options['loop']:
+                break
+            # если пачка была полной, сразу берем следующую
+            if sent + failed < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,110 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('richman.slow_requests')
+
+
+class QueryTimer:
+    """ execute_wrapper: считает запросы и их время, одинаковый SQL складывается (так видно N+1) """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.seconds += duration
+            statement = self.statements.setdefault(sql, [0, 0])
+            statement[0] += 1
+            statement[1] += duration
+
+    def slowest(self, limit):
+        statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [{'sql': sql, 'count': count, 'ms': round(seconds * 1000, 2)} for sql, (count, seconds) in statements]
+
+
+class ProfilingMiddleware:
+    """ Для доли запросов PROFILING_SAMPLE_RATE меряет время базы, view и рендеринга ответа,
+    отдает их в заголовке Server-Timing и пишет запросы дольше PROFILING_SLOW_REQUEST_MS в лог richman.slow_requests.
+    При PROFILING_SAMPLE_RATE = 0 Django вообще не подключает middleware """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.slow_request_ms = getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 500)
+        self.sql_limit = getattr(settings, 'PROFILING_SLOW_SQL_LIMIT', 10)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        request._profiling = {}
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            # обертка ставится на объект соединения этого потока, само соединение с базой не открывается
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        timings = self.get_timings(request._profiling, started, total, timer)
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={milliseconds:.1f}' + (f';desc="{timer.count} queries"' if name == 'db' else '')
+            for name, milliseconds in timings.items()
+        )
+        if timings['total'] >= self.slow_request_ms:
+            user = getattr(request, 'user', None)
+            logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'user': user.pk if user is not None and user.is_authenticated else None,
+                'queries': timer.count,
+                **{f'{name}_ms': round(milliseconds, 2) for name, milliseconds in timings.items()},
+                'sql': timer.slowest(self.sql_limit),
+            }, ensure_ascii=False))
+        return response
+
+    def get_timings(self, marks, started, total, timer):
+        timings = {'db': timer.seconds * 1000}
+        view_started = marks.get('view', started)
+        render_started = marks.get('render_started')
+        if render_started is not None:
+            timings['view'] = (render_started - view_started) * 1000
+            timings['render'] = (marks.get('render_finished', render_started) - render_started) * 1000
+        elif 'view' in marks:
+            timings['view'] = (started + total - view_started) * 1000
+        timings['total'] = total * 1000
+        return timings
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_profiling'):
+            request._profiling['view'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF Response рендерится (JSON) после view: засекаем начало и конец рендеринга отдельно
+        if not hasattr(request, '_profiling'):
+            return response
+
+        def render_finished(response):
+            request._profiling['render_finished'] = time.perf_counter()
+
+        request._profiling['render_started'] = time.perf_counter()
+        response.add_post_render_callback(render_finished)
+        return response
+
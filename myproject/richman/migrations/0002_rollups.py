@@ -0,0 +1,98 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:49
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+ROLLUP_FIELDS = ['sold_count', 'stock_count', 'spend', 'income', 'profit']
+
+
+def fill_rollups(apps, schema_editor):
+    Group = apps.get_model('richman', 'Group')
+    Product = apps.get_model('richman', 'Product')
+    ProductSize = apps.get_model('richman', 'ProductSize')
+
+    sold = Q(have=False)
+    high_price = Coalesce('high_price', 0)
+    product_totals = ProductSize.objects.order_by().values('product').annotate(
+        sold_count=Count('pk', filter=sold),
+        stock_count=Count('pk', filter=~sold),
+        spend=Sum('product__low_price'),
+        income=Coalesce(Sum(high_price, filter=sold), 0),
+        profit=Coalesce(Sum(high_price - F('product__low_price'), filter=sold), 0),
+    )
+    products = [Product(pk=row.pop('product'), **row) for row in product_totals]
+    Product.objects.bulk_update(products, ROLLUP_FIELDS, batch_size=500)
+
+    group_totals = Product.objects.order_by().values('group').annotate(
+        products_count=Count('pk'), **{field: Sum(field) for field in ROLLUP_FIELDS}
+    )
+    groups = [Group(pk=row.pop('group'), **row) for row in group_totals]
+    Group.objects.bulk_update(groups, ROLLUP_FIELDS + ['products_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('richman', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='income',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='products_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='profit',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='sold_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='spend',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='stock_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='income',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='profit',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sold_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='spend',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
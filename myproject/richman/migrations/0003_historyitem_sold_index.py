@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('richman', '0002_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historyitem',
+            index=models.Index(fields=['history', '-sold_date', '-id'], name='historyitem_history_sold_idx'),
+        ),
+    ]
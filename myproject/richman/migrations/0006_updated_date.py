@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('richman', '0005_product_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='productsize',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
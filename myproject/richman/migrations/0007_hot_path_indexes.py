@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('richman', '0006_updated_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['owner', 'updated_date'], name='group_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsize',
+            index=models.Index(fields=['product', 'have'], name='productsize_product_have_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsize',
+            index=models.Index(condition=models.Q(('have', True)), fields=['size', 'product'], name='productsize_in_stock_idx'),
+        ),
+        # индекс по FK удаляем после того, как появился составной (product, have)
+        migrations.AlterField(
+            model_name='productsize',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sizes', to='richman.product'),
+        ),
+    ]
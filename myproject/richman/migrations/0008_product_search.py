@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+# FTS5-индекс для поиска продуктов (richman/search.py); rowid = id продукта
+CREATE_TABLE_SQL = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS richman_product_fts USING fts5('
+    'product_name, article, description, owner_id UNINDEXED, '
+    "tokenize = \"unicode61 remove_diacritics 2 tokenchars '-_/'\")"
+)
+FILL_TABLE_SQL = (
+    'INSERT INTO richman_product_fts (rowid, product_name, article, description, owner_id) '
+    "SELECT p.id, p.product_name, COALESCE(p.article, ''), COALESCE(p.description, ''), g.owner_id "
+    'FROM richman_product p JOIN richman_group g ON g.id = p.group_id'
+)
+
+
+def create_search_index(apps, schema_editor):
+    # на других базах поиск работает через LIKE
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_TABLE_SQL)
+        schema_editor.execute(FILL_TABLE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS richman_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('richman', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('richman', '0009_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='tokens_revoked_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,17 +1,78 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
-from django.urls import reverse
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
-from django.core.mail import send_mail
-from django_rest_passwordreset.signals import reset_password_token_created
-from django.dispatch import receiver
 from datetime import date
 
 
+class FieldTrackerMixin:
+    """ Запоминает значения tracked_fields в момент загрузки из базы (from_db),
+    чтобы сигналы видели изменения полей без лишнего SELECT перед сохранением """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._store_tracked_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        values = self.__dict__.setdefault('_tracked_values', {})
+        for name, attname in self._tracked_attnames().items():
+            if (fields is None or name in fields or attname in fields) and attname in self.__dict__:
+                values[name] = self.__dict__[attname]
+
+    def _tracked_attnames(self):
+        return {name: self._meta.get_field(name).attname for name in self.tracked_fields}
+
+    def _store_tracked_values(self):
+        # отложенные (.only/.defer) поля в __dict__ отсутствуют, их не запоминаем
+        self._tracked_values = {
+            name: self.__dict__[attname]
+            for name, attname in self._tracked_attnames().items() if attname in self.__dict__
+        }
+
+    def _load_previous_values(self):
+        """ Объект собран вручную или поля были отложены: недостающие значения читаем из базы одним запросом """
+        values = self.__dict__.setdefault('_tracked_values', {})
+        attnames = self._tracked_attnames()
+        if set(attnames) - set(values):
+            row = type(self)._base_manager.filter(pk=self.pk).values(*attnames.values()).first() or {}
+            for tracked_name, attname in attnames.items():
+                values.setdefault(tracked_name, row.get(attname, getattr(self, attname)))
+        return values
+
+    def get_previous_value(self, name):
+        """ Значение поля, которое сейчас лежит в базе (для FK — id) """
+        values = self.__dict__.setdefault('_tracked_values', {})
+        if name not in values:
+            values = self._load_previous_values()
+        return values[name]
+
+    def has_changed(self, name):
+        return self.get_previous_value(name) != getattr(self, self._meta.get_field(name).attname)
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            # у нового объекта "старые" значения совпадают с текущими
+            self._store_tracked_values()
+        else:
+            # после UPDATE в базе уже новые значения, поэтому недостающие старые читаем до сохранения
+            self._load_previous_values()
+        super().save(*args, **kwargs)
+        # post_save уже отработал, дальше сравниваем с только что сохраненным состоянием
+        self._store_tracked_values()
+
+
 class UserProfile(AbstractUser):
     phone = PhoneNumberField(null=True, blank=True, region='KG')
     date_registered = models.DateTimeField(auto_now_add=True)
+    # access-токены, выданные раньше, не действуют (выход); в отличие от отметок в кеше переживает его очистку
+    tokens_revoked_date = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.first_name
@@ -25,10 +86,75 @@ class Seller(models.Model):
         return f'{self.seller_name} {self.owner}'
 
 
-class Group(models.Model):
+class RollupModel(models.Model):
+    """ Итоги по размерам, которые поддерживаются сигналами из richman/signals.py """
+    # без Positive*: при расхождении итогов сохранение не должно падать на CHECK-ограничении,
+    # расхождение исправляет команда rebuild_rollups
+    sold_count = models.IntegerField(default=0, editable=False)
+    stock_count = models.IntegerField(default=0, editable=False)
+    spend = models.IntegerField(default=0, editable=False)
+    income = models.IntegerField(default=0, editable=False)
+    profit = models.IntegerField(default=0, editable=False)
+
+    rollup_fields = ('sold_count', 'stock_count', 'spend', 'income', 'profit')
+    # другие поля, которые пишутся только через update() в обход save()
+    derived_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # итоги меняются только через F()-обновления из сигналов, поэтому при обычном
+        # сохранении их не перезаписываем устаревшими значениями из памяти
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = self.rollup_fields + self.derived_fields
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        # сигналы пересчета итогов выполняются в той же транзакции, что и сохранение
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class GroupQuerySet(models.QuerySet):
+    def with_totals(self):
+        """ Итоги группы, посчитанные заново по таблицам продуктов и размеров: каждый показатель
+        считается коррелированным подзапросом, поэтому join'ы фильтров не искажают суммы """
+        products = Product.objects.filter(group=OuterRef('pk')).order_by().values('group')
+        sizes = ProductSize.objects.filter(product__group=OuterRef('pk')).order_by().values('product__group')
+        sold_sizes = sizes.filter(have=False)
+
+        def total(queryset, expression):
+            return Coalesce(Subquery(queryset.annotate(total=expression).values('total')), 0)
+
+        return self.annotate(
+            count_products=total(products, Count('pk')),
+            count_sold_sizes=total(sold_sizes, Count('pk')),
+            count_all_sizes=total(sizes, Count('pk')),
+            group_spend=total(sizes, Sum('product__low_price')),
+            products_income=total(sold_sizes, Sum(Coalesce('high_price', 0))),
+            products_profit=total(sold_sizes, Sum(Coalesce('high_price', 0) - F('product__low_price'))),
+        )
+
+    def with_products(self):
+        """ Продукты и все их размеры подгружаются по одному запросу на таблицу """
+        return self.prefetch_related(
+            Prefetch('products', queryset=Product.objects.prefetch_related('sizes')),
+        )
+
+
+class Group(RollupModel):
     owner = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='groups_owner')
     group_date = models.DateField(default=date.today)
     created_date = models.DateTimeField(auto_now_add=True)
+    # меняется и при изменении любого продукта/размера группы (см. richman/rollups.py)
+    updated_date = models.DateTimeField(auto_now=True)
+    products_count = models.IntegerField(default=0, editable=False)
+
+    rollup_fields = RollupModel.rollup_fields + ('products_count',)
+
+    objects = GroupQuerySet.as_manager()
 
     def clean(self):
         super().clean()
@@ -38,47 +164,35 @@ class Group(models.Model):
     def __str__(self):
         return f'{self.group_date} {self.owner.first_name}'  # {self.products.count()}
 
-    def get_count_products(self):
-        return self.products.count()
-
-    def get_count_sold_sizes(self):
-        return ProductSize.objects.filter(product__group=self, have=False).count()
-
-    def get_count_all_sizes(self):
-        return ProductSize.objects.filter(product__group=self).count()
-
-    def get_group_spend(self):
-        all_spend = self.products.all()
-        spends = sum([i.sizes.count() * i.low_price for i in all_spend])
-        if spends:
-            return spends
-        return 0
-
-    def get_products_income(self):
-        all_income = self.products.all()
-        total = sum(
-            size.high_price
-            for product in all_income
-            for size in product.sizes.filter(have=False)
-        )
-        return total
-
-    def get_products_profit(self):
-        all_products = self.products.all()
-        total_profit = 0
-        for product in all_products:
-            sold_sizes = product.sizes.filter(have=False)
-            income = sum(size.high_price for size in sold_sizes)
-            expense = sold_sizes.count() * product.low_price
-            total_profit += income - expense
-        return total_profit
-
     class Meta:
+        # unique_together уже дает индекс (owner, group_date) для списка групп
         unique_together = ('owner', 'group_date')
         ordering = ['-group_date']
+        indexes = [
+            # MAX(updated_date) для ETag списка групп читается из индекса
+            models.Index(fields=['owner', 'updated_date'], name='group_owner_updated_idx'),
+        ]
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_totals(self):
+        """ Итоги продукта, посчитанные заново по таблице размеров """
+        sizes = ProductSize.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        sold_sizes = sizes.filter(have=False)
+
+        def total(queryset, expression):
+            return Coalesce(Subquery(queryset.annotate(total=expression).values('total')), 0)
+
+        return self.annotate(
+            count_sold_sizes=total(sold_sizes, Count('pk')),
+            count_all_sizes=total(sizes, Count('pk')),
+            products_spend=total(sizes, Sum('product__low_price')),
+            products_income=total(sold_sizes, Sum(Coalesce('high_price', 0))),
+            products_profit=total(sold_sizes, Sum(Coalesce('high_price', 0) - F('product__low_price'))),
+        )
 
 
-class Product(models.Model):
+class Product(FieldTrackerMixin, RollupModel):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='products')
     image = models.ImageField(upload_to='product_image', null=True, blank=True)
     product_name = models.CharField(max_length=64)
@@ -86,44 +200,42 @@ class Product(models.Model):
     low_price = models.PositiveSmallIntegerField()
     article = models.CharField(max_length=32, null=True, blank=True)
     created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+    # {'small': {'webp': path, 'jpeg': path}, ...}, заполняется в фоне после загрузки image
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
 
-    def __str__(self):
-        return self.product_name
+    objects = ProductQuerySet.as_manager()
 
-    def get_products_spend(self):
-        sizes = self.sizes.all()
-        if sizes.exists():
-            return sizes.count() * self.low_price
-        return 0
-
-    # убрал if size.high_price потому что поль-тель обязан ее написать в ProductSize
-    def get_products_income(self):
-        sold_sizes = self.sizes.filter(have=False)
-        if sold_sizes.exists():
-            return sum(size.high_price for size in sold_sizes)
-        return 0
+    tracked_fields = ('low_price', 'group', 'image')
+    derived_fields = ('thumbnails',)
 
-    def get_products_profit(self):
-        sold_sizes = self.sizes.filter(have=False)
-        if sold_sizes.exists():
-            return sum(size.high_price for size in sold_sizes) - sold_sizes.count() * self.low_price
-        return 0
+    def __str__(self):
+        return self.product_name
 
     class Meta:
         ordering = ['-product_name']
 
 
-class ProductSize(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sizes')
+class ProductSize(FieldTrackerMixin, models.Model):
+    # отдельный индекс по product не нужен: его покрывает составной (product, have)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sizes', db_index=False)
     size = models.PositiveSmallIntegerField()
     have = models.BooleanField(default=True)
     high_price = models.PositiveIntegerField(null=True, blank=True)
     seller = models.ForeignKey(Seller, on_delete=models.SET_NULL, null=True, blank=True)
     sold_date = models.DateTimeField(auto_now=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    tracked_fields = ('product', 'have', 'high_price', 'seller')
 
     def __str__(self):
         return f'{self.product.product_name}  {self.size}'
 
+    def save(self, *args, **kwargs):
+        # сигналы пересчета итогов выполняются в той же транзакции, что и сохранение
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def get_profit(self):
         if self.high_price:
             return self.high_price - self.product.low_price
@@ -136,6 +248,14 @@ class ProductSize(models.Model):
         if self.high_price is not None and self.high_price < self.product.low_price:
             raise ValidationError({'high_price': 'Поле high_price не может быть меньше, чем low_price продукта.'})
 
+    class Meta:
+        indexes = [
+            # проданные/оставшиеся размеры продукта
+            models.Index(fields=['product', 'have'], name='productsize_product_have_idx'),
+            # фильтр групп "есть в наличии размер N": частичный индекс только по размерам в наличии
+            models.Index(fields=['size', 'product'], condition=models.Q(have=True), name='productsize_in_stock_idx'),
+        ]
+
 
 class History(models.Model):
     user = models.OneToOneField(UserProfile, on_delete=models.CASCADE)
@@ -155,22 +275,50 @@ class HistoryItem(models.Model):
 
     class Meta:
         ordering = ['-sold_date']
+        indexes = [
+            # страницы /history/items/ по курсору (sold_date, id) внутри истории пользователя
+            models.Index(fields=['history', '-sold_date', '-id'], name='historyitem_history_sold_idx'),
+        ]
+
+
+class OutgoingEmail(models.Model):
+    """ Очередь писем: запрос только ставит письмо в очередь, отправляет его команда send_emails """
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('sent', 'sent'),
+        ('failed', 'failed'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(null=True, blank=True)
 
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.recipients)} ({self.status})'
 
-@receiver(reset_password_token_created)
-def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
-    email_plaintext_message = "{}?token={}".format(
-        reverse('password_reset:reset-password-request'),
-        reset_password_token.key
-    )
+    @classmethod
+    def queue(cls, subject, body, recipients, from_email='noreply@somehost.local'):
+        return cls.objects.create(subject=subject, body=body, recipients=list(recipients), from_email=from_email)
 
-    send_mail(
-        # Subject
-        "Password Reset for {title}".format(title="Some website title"),
-        # Message
-        email_plaintext_message,
-        # From email
-        "noreply@somehost.local",
-        # Recipient list
-        [reset_password_token.user.email]
-    )
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_date'], name='outgoingemail_pending_idx'),
+        ]
+
+
+class RevokedToken(models.Model):
+    """ Отозванные JWT (выход, ротация refresh). Хранятся только до истечения токена, дальше их удаляет
+    команда purge_revoked_tokens; при проверке база нужна только если в кеше нет записи """
+    jti = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, null=True, blank=True)
+    expires_date = models.DateTimeField(db_index=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.jti} ({self.user_id})'
@@ -0,0 +1,58 @@
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutgoingEmail
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(minutes=1)
+
+
+def schedule_retry(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        # 1, 2, 4, 8 минут между попытками
+        email.next_attempt_date = now + RETRY_DELAY * 2 ** (email.attempts - 1)
+
+
+def send_queued_emails(batch_size=50):
+    """ Отправляет пачку писем из очереди через одно SMTP-соединение.
+    Возвращает (отправлено, отложено или провалено) """
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked: несколько воркеров не возьмут одно и то же письмо
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_date__lte=now)
+            .order_by('next_attempt_date')[:batch_size]
+        )
+        if not emails:
+            return 0, 0
+
+        sent = 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            for email in emails:
+                schedule_retry(email, error, now)
+        else:
+            for email in emails:
+                try:
+                    EmailMessage(email.subject, email.body, email.from_email, email.recipients,
+                                 connection=connection).send()
+                except Exception as error:
+                    schedule_retry(email, error, now)
+                else:
+                    email.status = 'sent'
+                    email.sent_date = timezone.now()
+                    sent += 1
+            connection.close()
+
+        OutgoingEmail.objects.bulk_update(
+            emails, ['status', 'attempts', 'next_attempt_date', 'last_error', 'sent_date']
+        )
+    return sent, len(emails) - sent
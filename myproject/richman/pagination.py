@@ -0,0 +1,63 @@
+import hashlib
+from urllib.parse import urlencode
+from django.core.cache import cache
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from .cache import get_version
+
+
+class HistoryItemCursorPagination(CursorPagination):
+    # курсор по (sold_date, id): страница читается по индексу, без OFFSET
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-sold_date', '-id')
+
+
+class ProductSearchPagination(PageNumberPagination):
+    # результаты поиска упорядочены по релевантности, курсор по полям здесь не подходит
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CountedCursorPagination(CursorPagination):
+    """ Курсорная пагинация; с ?count=true в ответ добавляется общее количество.
+    Количество кешируется по версиям cache_scopes вьюхи, поэтому COUNT(*) идет только после изменений """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = self.get_count(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset, request, view):
+        skip = (self.cursor_query_param, self.page_size_query_param, self.count_query_param, 'ordering')
+        params = urlencode(sorted((key, value) for key, value in request.query_params.items() if key not in skip))
+        scopes = getattr(view, 'cache_scopes', ())
+        if not scopes:
+            return queryset.order_by().count()
+
+        versions = ':'.join(str(get_version(scope, request.user.id)) for scope in scopes)
+        digest = hashlib.md5(params.encode()).hexdigest()
+        key = f'richman:count:{type(view).__name__}:{request.user.id}:{versions}:{digest}'
+        return cache.get_or_set(key, lambda: queryset.order_by().count(), 60 * 60)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = {'count': self.count, **response.data}
+        return response
+
+
+class GroupCursorPagination(CountedCursorPagination):
+    # совпадает с Group.Meta.ordering; id — на случай одинаковых дат
+    page_size = 30
+    ordering = ('-group_date', '-id')
+
+
+class SellerCursorPagination(CountedCursorPagination):
+    ordering = ('-id',)
@@ -6,16 +6,22 @@ class CheckUserEdit(permissions.BasePermission):
         return request.user.id == obj.id
 
 
-class CheckEdit(permissions.BasePermission):
+# Вьюхи с этими проверками уже берут объекты только текущего пользователя (get_queryset фильтрует по владельцу),
+# поэтому чужой объект дает 404. Здесь остается сравнение id без загрузки связанных объектов
+
+
+class CheckEdit(permissions.IsAuthenticated):
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.owner
+        return request.user.id == obj.owner_id
 
 
-class CheckProductEdit(permissions.BasePermission):
+class CheckProductEdit(permissions.IsAuthenticated):
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.group.owner
+        # group подгружен через select_related
+        return request.user.id == obj.group.owner_id
 
 
-class CheckProductSizeEdit(permissions.BasePermission):
+class CheckProductSizeEdit(permissions.IsAuthenticated):
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.product.group.owner
+        # product и product.group подгружены через select_related
+        return request.user.id == obj.product.group.owner_id
@@ -0,0 +1,56 @@
+from django.db.models import F, QuerySet
+from django.utils import timezone
+from .models import Group, Product, RollupModel
+
+
+def size_contribution(have, high_price, low_price):
+    """ Вклад одного размера в итоги продукта и группы """
+    if have:
+        return {'stock_count': 1, 'spend': low_price}
+    high_price = high_price or 0
+    return {'sold_count': 1, 'spend': low_price, 'income': high_price, 'profit': high_price - low_price}
+
+
+def subtract(new, old):
+    return {field: new.get(field, 0) - old.get(field, 0) for field in RollupModel.rollup_fields}
+
+
+def negate(delta):
+    return {field: -value for field, value in delta.items()}
+
+
+def apply_delta(model, pk, delta):
+    """ Атомарно прибавляет дельту к итогам строки через F(), без чтения из базы.
+    updated_date родителя двигается всегда: по нему считаются ETag/Last-Modified """
+    changes = {field: F(field) + value for field, value in delta.items() if value}
+    model.objects.filter(pk=pk).update(updated_date=timezone.now(), **changes)
+
+
+def apply_size_delta(product_id, group_id, delta):
+    apply_delta(Product, product_id, delta)
+    apply_delta(Group, group_id, delta)
+
+
+def apply_bulk_size_deltas(size_deltas):
+    """ Суммирует дельты размеров по продуктам и применяет их по два UPDATE на продукт.
+    Нужно для bulk-операций, которые идут в обход сигналов """
+    deltas = {}
+    for size, size_delta in size_deltas:
+        group_id, delta = deltas.setdefault(size.product_id, (size.product.group_id, {}))
+        for field, value in size_delta.items():
+            delta[field] = delta.get(field, 0) + value
+    for product_id, (group_id, delta) in deltas.items():
+        apply_size_delta(product_id, group_id, delta)
+
+
+def apply_bulk_size_contributions(sizes):
+    apply_bulk_size_deltas(
+        (size, size_contribution(size.have, size.high_price, size.product.low_price)) for size in sizes
+    )
+
+
+def is_deleted_directly(origin, model):
+    """ True, если delete() вызван на самом объекте (или queryset'е) этой модели, а не каскадом от родителя """
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
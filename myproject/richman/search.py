@@ -0,0 +1,99 @@
+from django.db import connection
+from django.db.models import Q
+from .cache import get_owner_id
+from .models import Group, Product
+
+# таблицу создает миграция 0008_product_search; rowid = id продукта.
+# '-', '_' и '/' там считаются частью слова, чтобы артикул вроде AB-123/2 был одним токеном
+FTS_TABLE = 'richman_product_fts'
+# веса столбцов для bm25(): product_name, article, description
+COLUMN_WEIGHTS = (5.0, 10.0, 1.0)
+
+
+def is_available():
+    """ FTS5 есть только у SQLite; на других базах поиск идет обычным LIKE """
+    return connection.vendor == 'sqlite'
+
+
+def build_match_query(text):
+    """ Каждое слово запроса — префиксный терм в кавычках: 'AB-12' найдет AB-123, 'крос' найдет 'Кроссовки'.
+    Кавычки экранируются, поэтому синтаксис FTS5 (OR, NEAR, *) из запроса не работает """
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def get_index_row(product, owner_id=None):
+    if owner_id is None:
+        owner_id = get_owner_id(Group, product.group_id, 'owner_id')
+    return product.pk, product.product_name, product.article or '', product.description or '', owner_id
+
+
+def write_rows(rows):
+    rows = list(rows)
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, product_name, article, description, owner_id) '
+            'VALUES (%s, %s, %s, %s, %s)', rows
+        )
+
+
+def index_products(products, owner_id=None):
+    """ Обновляет строки индекса для продуктов. bulk_create/update() идут в обход сигналов,
+    поэтому такие пути вызывают это сами """
+    if is_available():
+        write_rows(get_index_row(product, owner_id) for product in products)
+
+
+def remove_products(product_ids):
+    if is_available() and product_ids:
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+
+def rebuild_index(batch_size=500):
+    """ Заполняет индекс заново по всем продуктам, возвращает количество строк """
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    products = Product.objects.values_list('pk', 'product_name', 'article', 'description', 'group__owner_id')
+    batch, count = [], 0
+    for pk, product_name, article, description, owner_id in products.order_by('pk').iterator(chunk_size=batch_size):
+        batch.append((pk, product_name, article or '', description or '', owner_id))
+        if len(batch) >= batch_size:
+            write_rows(batch)
+            count += len(batch)
+            batch = []
+    write_rows(batch)
+    count += len(batch)
+
+    with connection.cursor() as cursor:
+        # сливаем сегменты индекса после массовой вставки
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def search_product_ids(owner_id, text):
+    """ id продуктов владельца, лучшие совпадения первыми """
+    if not text.split():
+        return []
+    if not is_available():
+        condition = Q()
+        for term in text.split():
+            condition &= Q(product_name__icontains=term) | Q(article__istartswith=term) | \
+                Q(description__icontains=term)
+        products = Product.objects.filter(condition, group__owner_id=owner_id)
+        return list(products.order_by('product_name', 'pk').values_list('pk', flat=True))
+
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND owner_id = %s '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid',
+            [build_match_query(text), owner_id]
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -1,8 +1,20 @@
-from django_rest_passwordreset.models import ResetPasswordToken
+from datetime import timedelta
+from django_rest_passwordreset.models import ResetPasswordToken, get_password_reset_token_expiry_time
 from rest_framework import serializers
 from .models import *
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from .cache import bump_owner_versions
+from .db import update_returning_pks
+from .tokens import RevocableRefreshToken, revoke_token
+from .throttling import add_reset_attempt, clear_reset_attempts, get_reset_attempts, get_reset_max_attempts
+from .rollups import apply_bulk_size_contributions, apply_bulk_size_deltas, size_contribution, subtract
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -49,6 +61,28 @@ class LoginSerializer(serializers.Serializer):
         }
 
 
+class TokenRefreshSerializer(serializers.Serializer):
+    """ Обновление access по refresh (SIMPLE_JWT['TOKEN_REFRESH_SERIALIZER']). При ротации старый refresh отзывается,
+    поэтому им нельзя воспользоваться второй раз """
+    refresh = serializers.CharField()
+    access = serializers.CharField(read_only=True)
+
+    def validate(self, attrs):
+        try:
+            refresh = RevocableRefreshToken(attrs['refresh'])
+        except TokenError as error:
+            raise InvalidToken(error.args[0])
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            revoke_token(refresh)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
+
 class UserProfileListSerializer(serializers.ModelSerializer):
     date_registered = serializers.DateTimeField(format='%d-%m-%Y %H:%M')
 
@@ -100,41 +134,125 @@ class GroupSerializer(serializers.ModelSerializer):
 class GroupListSerializer(serializers.ModelSerializer):
     group_date = serializers.DateField(format='%d-%m-%Y')
     owner = UserProfile()
-    count_products = serializers.SerializerMethodField()
-    count_sold_sizes = serializers.SerializerMethodField()
+    # итоги хранятся в самой группе и поддерживаются сигналами
+    count_products = serializers.IntegerField(source='products_count', read_only=True)
+    count_sold_sizes = serializers.IntegerField(source='sold_count', read_only=True)
     count_all_sizes = serializers.SerializerMethodField()
-    group_spend = serializers.SerializerMethodField()
-    products_income = serializers.SerializerMethodField()
-    products_profit = serializers.SerializerMethodField()
+    group_spend = serializers.IntegerField(source='spend', read_only=True)
+    products_income = serializers.IntegerField(source='income', read_only=True)
+    products_profit = serializers.IntegerField(source='profit', read_only=True)
 
     class Meta:
         model = Group  # if u need, add 'created_date'
         fields = ['id', 'group_date', 'owner', 'count_products', 'count_sold_sizes', 'count_all_sizes',
                   'group_spend', 'products_income', 'products_profit']
 
-    def get_count_products(self, obj):
-        return obj.get_count_products()
+    def get_count_all_sizes(self, obj):
+        return obj.sold_count + obj.stock_count
 
-    def get_count_sold_sizes(self, obj):
-        return obj.get_count_sold_sizes()
 
-    def get_count_all_sizes(self, obj):
-        return obj.get_count_all_sizes()
+class ProductSizeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductSize
+        fields = ['size', 'high_price', 'have', 'seller']
 
-    def get_group_spend(self, obj):
-        return obj.get_group_spend()
 
-    def get_products_income(self, obj):
-        return obj.get_products_income()
+class ProductSizeBulkListSerializer(serializers.ListSerializer):
+    max_sizes = 500
 
-    def get_products_profit(self, obj):
-        return obj.get_products_profit()
+    def validate(self, attrs):
+        if sum(item['quantity'] for item in attrs) > self.max_sizes:
+            raise serializers.ValidationError(f'За один запрос можно создать не больше {self.max_sizes} размеров.')
+        return attrs
 
+    def create(self, validated_data):
+        sizes = []
+        for item in validated_data:
+            quantity = item.pop('quantity')
+            sizes.extend(ProductSize(**item) for _ in range(quantity))
+
+        # bulk_create не вызывает сигналы: новые размеры в историю не попадают (как и при обычном создании),
+        # а итоги продукта и группы обновляем сами
+        with transaction.atomic():
+            sizes = ProductSize.objects.bulk_create(sizes)
+            apply_bulk_size_contributions(sizes)
+        bump_owner_versions(self.context['request'].user.id, 'groups')
+        return sizes
+
+
+class ProductSizeBulkSerializer(ProductSizeSerializer):
+    quantity = serializers.IntegerField(min_value=1, default=1, write_only=True)
+
+    class Meta(ProductSizeSerializer.Meta):
+        fields = ProductSizeSerializer.Meta.fields + ['quantity']
+        list_serializer_class = ProductSizeBulkListSerializer
+
+
+class ProductSizeSellListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        owner = self.context['request'].user
+        size_ids = [item['size_id'] for item in attrs]
+        if len(set(size_ids)) != len(size_ids):
+            raise serializers.ValidationError('Каждый размер можно указать только один раз.')
+
+        sizes = ProductSize.objects.filter(product__group__owner=owner).select_related('product').in_bulk(size_ids)
+        missing = [size_id for size_id in size_ids if size_id not in sizes]
+        if missing:
+            raise serializers.ValidationError(f'Размеры не найдены или не принадлежат вам: {missing}')
+
+        seller_ids = {item['seller'] for item in attrs if item.get('seller') is not None}
+        if seller_ids and Seller.objects.filter(owner=owner, pk__in=seller_ids).count() != len(seller_ids):
+            raise serializers.ValidationError('Продавец не найден или не принадлежит вам.')
+
+        for item in attrs:
+            item['size'] = sizes[item['size_id']]
+            if item['high_price'] < item['size'].product.low_price:
+                raise serializers.ValidationError(
+                    f'Размер {item["size_id"]}: high_price не может быть меньше, чем low_price продукта.'
+                )
+        return attrs
+
+    def create(self, validated_data):
+        items = {item['size_id']: item for item in validated_data}
+        with transaction.atomic():
+            # compare-and-set: продаются ровно те строки, которые изменил этот UPDATE ... WHERE have,
+            # даже если параллельный запрос успел продать часть размеров
+            sold = set(update_returning_pks(
+                ProductSize.objects.filter(pk__in=items, have=True),
+                have=False,
+                sold_date=timezone.now(),
+                updated_date=timezone.now(),
+                high_price=Case(*[When(pk=pk, then=Value(item['high_price'])) for pk, item in items.items()]),
+                seller=Case(*[When(pk=pk, then=Value(item.get('seller'))) for pk, item in items.items()]),
+            ))
+            available = [size_id for size_id in items if size_id in sold]
+            if available:
+                # update() не вызывает сигналы: историю и итоги записываем сами, пачкой
+                history, created = History.objects.get_or_create(user=self.context['request'].user)
+                HistoryItem.objects.bulk_create([
+                    HistoryItem(history=history, product_id=items[pk]['size'].product_id, product_size_id=pk)
+                    for pk in available
+                ])
+                bump_owner_versions(history.user_id, 'groups', 'history')
+                apply_bulk_size_deltas(
+                    (size, subtract(size_contribution(False, item['high_price'], size.product.low_price),
+                                    size_contribution(True, None, size.product.low_price)))
+                    for item, size in ((items[pk], items[pk]['size']) for pk in available)
+                )
+
+        return {
+            'sold': available,
+            'already_sold': [size_id for size_id in items if size_id not in sold],
+        }
+
+
+class ProductSizeSellSerializer(serializers.Serializer):
+    size_id = serializers.IntegerField()
+    high_price = serializers.IntegerField(min_value=0)
+    seller = serializers.IntegerField(required=False, allow_null=True)
 
-class ProductSizeSerializer(serializers.ModelSerializer):
     class Meta:
-        model = ProductSize
-        fields = ['size', 'high_price', 'have', 'seller']
+        list_serializer_class = ProductSizeSellListSerializer
 
 
 class ProductSizeListSerializer(serializers.ModelSerializer):
@@ -161,25 +279,46 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['product_name', 'description', 'low_price', 'image', 'article']
 
 
+def get_thumbnail_urls(product, request):
+    """ {'small': {'webp': url, 'jpeg': url}, ...} или None, пока превью еще не готовы """
+    if not product.thumbnails:
+        return None
+    urls = {}
+    for size_name, paths in product.thumbnails.items():
+        urls[size_name] = {}
+        for extension, path in paths.items():
+            url = default_storage.url(path)
+            urls[size_name][extension] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     sizes = ProductSizeListSerializer(many=True, read_only=True)
-    products_spend = serializers.SerializerMethodField()
-    products_income = serializers.SerializerMethodField()
-    products_profit = serializers.SerializerMethodField()
+    products_spend = serializers.IntegerField(source='spend', read_only=True)
+    products_income = serializers.IntegerField(source='income', read_only=True)
+    products_profit = serializers.IntegerField(source='profit', read_only=True)
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['image', 'product_name', 'article', 'sizes', 'products_spend',
+        fields = ['image', 'thumbnails', 'product_name', 'article', 'sizes', 'products_spend',
                   'products_income', 'products_profit'] # 'group', 'description', 'low_price', 'high_price', 'created_date',
 
-    def get_products_spend(self, obj):
-        return obj.get_products_spend()
+    def get_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, self.context.get('request'))
+
 
-    def get_products_income(self, obj):
-        return obj.get_products_income()
+class ProductSearchSerializer(serializers.ModelSerializer):
+    group_date = serializers.DateField(source='group.group_date', read_only=True)
+    thumbnails = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'group', 'group_date', 'product_name', 'article', 'description', 'low_price', 'image',
+                  'thumbnails', 'stock_count', 'sold_count']
 
-    def get_products_profit(self, obj):
-        return obj.get_products_profit()
+    def get_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, self.context.get('request'))
 
 
 class ProductNameSerializer(serializers.ModelSerializer):
@@ -214,6 +353,32 @@ class HistorySerializer(serializers.ModelSerializer):
         fields = ['user', 'history_items']
 
 
+class SalesAnalyticsSerializer(serializers.Serializer):
+    period = serializers.DateField(format='%d-%m-%Y')
+    units = serializers.IntegerField()
+    income = serializers.IntegerField()
+    cost = serializers.IntegerField()
+    profit = serializers.IntegerField()
+
+
+class InventorySizeSerializer(serializers.Serializer):
+    size = serializers.IntegerField()
+    count = serializers.IntegerField()
+
+
+class InventoryProductSerializer(serializers.Serializer):
+    article = serializers.CharField(allow_null=True)
+    product_name = serializers.CharField()
+    count = serializers.IntegerField()
+    sizes = InventorySizeSerializer(many=True)
+
+
+class InventorySerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    sizes = InventorySizeSerializer(many=True)
+    products = InventoryProductSerializer(many=True)
+
+
 class GroupDetailSerializer(serializers.ModelSerializer):
     group_date = serializers.DateField(format='%d-%m-%Y')
     products = ProductListSerializer(many=True, read_only=True)
@@ -226,10 +391,15 @@ class GroupDetailSerializer(serializers.ModelSerializer):
 class ProductDetailSerializer(serializers.ModelSerializer):
     created_date = serializers.DateTimeField(format='%d-%m-%Y %H:%M')
     sizes = ProductSizeDetailSerializer(many=True, read_only=True)
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['image', 'product_name', 'article', 'description', 'low_price', 'sizes', 'created_date']
+        fields = ['image', 'thumbnails', 'product_name', 'article', 'description', 'low_price', 'sizes',
+                  'created_date']
+
+    def get_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, self.context.get('request'))
 
 
 class VerifyResetCodeSerializer(serializers.Serializer):
@@ -241,12 +411,23 @@ class VerifyResetCodeSerializer(serializers.Serializer):
         email = data.get('email')
         reset_code = data.get('reset_code')
 
+        # Лимит попыток на код проверяем по кешу, до запроса в базу
+        if get_reset_attempts(email) >= get_reset_max_attempts():
+            raise serializers.ValidationError("Слишком много неверных попыток. Запросите новый код.")
+
         # Проверяем, существует ли указанный код для email
         try:
-            token = ResetPasswordToken.objects.get(user__email=email, key=reset_code)
+            token = ResetPasswordToken.objects.select_related('user').get(user__email=email, key=reset_code)
         except ResetPasswordToken.DoesNotExist:
+            if add_reset_attempt(email) >= get_reset_max_attempts():
+                # 4 цифры подбираются перебором: после N ошибок код сгорает
+                ResetPasswordToken.objects.filter(user__email=email).delete()
             raise serializers.ValidationError("Неверный код сброса или email.")
 
+        if token.created_at + timedelta(hours=get_password_reset_token_expiry_time()) < timezone.now():
+            token.delete()
+            raise serializers.ValidationError("Срок действия кода истек. Запросите новый код.")
+
         data['user'] = token.user
         return data
 
@@ -257,3 +438,6 @@ class VerifyResetCodeSerializer(serializers.Serializer):
         # Устанавливаем новый пароль
         user.set_password(new_password)
         user.save()
+        # код одноразовый
+        ResetPasswordToken.objects.filter(user=user).delete()
+        clear_reset_attempts(self.validated_data['email'])
@@ -1,7 +1,9 @@
 import random
-from django.core.mail import send_mail
 from django_rest_passwordreset.signals import reset_password_token_created
 from django.dispatch import receiver
+from .models import Group, Product, ProductSize, Seller, History, HistoryItem, OutgoingEmail, UserProfile
+from .cache import bump_owner_versions, bump_version, get_owner_id
+from .throttling import clear_reset_attempts
 
 
 @receiver(reset_password_token_created)
@@ -12,42 +14,38 @@ def password_reset_token_created(sender, instance, reset_password_token, *args,
     # Сохраняем код в поле key токена
     reset_password_token.key = str(reset_code)
     reset_password_token.save()
+    # новый код — новый счетчик неверных попыток
+    clear_reset_attempts(reset_password_token.user.email)
 
     # Текст сообщения
     email_plaintext_message = f"Ваш код для сброса пароля: {reset_code}"
 
-    # Отправка email
-    send_mail(
+    # Ставим email в очередь, отправит его команда send_emails (SMTP не держит запрос)
+    OutgoingEmail.queue(
         "Сброс пароля",  # Тема письма
         email_plaintext_message,  # Текст письма
-        "noreply@somehost.local",  # От кого
         [reset_password_token.user.email],  # Список получателей
-        fail_silently=False,
     )
 
 
-from django.db.models.signals import post_save, pre_save
-from .models import ProductSize, History, HistoryItem
-
-
-@receiver(pre_save, sender=ProductSize)
-def store_previous_have(sender, instance, **kwargs):
-    if instance.pk:
-        # Получаем старое значение из базы данных перед сохранением
-        previous_instance = ProductSize.objects.get(pk=instance.pk)
-        instance._previous_have = previous_instance.have
-    else:
-        instance._previous_have = instance.have
+from django.db.models.signals import post_delete, post_save, pre_delete
+from .images import schedule_thumbnails
+from .rollups import apply_delta, apply_size_delta, is_deleted_directly, negate, size_contribution, subtract
+from .search import index_products, remove_products
 
 
 @receiver(post_save, sender=ProductSize)
 def add_to_or_remove_from_history(sender, instance, **kwargs):
     """ После сохранения добавляем или удаляем из истории в зависимости от изменения `have` """
-    if hasattr(instance, '_previous_have'):
+    # старое значение запомнено при загрузке объекта (FieldTrackerMixin), отдельный SELECT не нужен
+    previous_have = instance.get_previous_value('have')
+    if previous_have != instance.have:
         # Если `have` изменилось с True на False, добавляем в историю
-        if instance._previous_have and not instance.have:
+        if previous_have and not instance.have:
             # Добавляем в History, если `have` изменилось с True на False
-            history, created = History.objects.get_or_create(user=instance.product.group.owner)
+            history, created = History.objects.get_or_create(
+                user_id=get_owner_id(Group, instance.product.group_id, 'owner_id')
+            )
             HistoryItem.objects.create(
                 history=history,
                 product=instance.product,
@@ -55,10 +53,167 @@ def add_to_or_remove_from_history(sender, instance, **kwargs):
             )
 
         # Если `have` изменилось с False на True, удаляем из истории
-        elif not instance._previous_have and instance.have:
+        elif not previous_have and instance.have:
             # Удаляем из истории, если `have` изменилось с False на True
             history_items = HistoryItem.objects.filter(
-                history__user=instance.product.group.owner,
+                history__user_id=get_owner_id(Group, instance.product.group_id, 'owner_id'),
                 product_size=instance
             )
             history_items.delete()  # Удаляет все связанные записи
+
+
+@receiver(post_save, sender=ProductSize)
+def update_rollups_on_size_save(sender, instance, created, raw=False, **kwargs):
+    """ Переносим изменение размера в итоги продукта и группы """
+    if raw:
+        return
+    product = instance.product
+    contribution = size_contribution(instance.have, instance.high_price, product.low_price)
+    if created:
+        apply_size_delta(product.pk, product.group_id, contribution)
+        return
+
+    previous_product_id = instance.get_previous_value('product')
+    if previous_product_id == product.pk:
+        previous_product = product
+    else:
+        # размер перенесли в другой продукт
+        previous_product = Product.objects.only('low_price', 'group_id').get(pk=previous_product_id)
+    previous_contribution = size_contribution(
+        instance.get_previous_value('have'), instance.get_previous_value('high_price'), previous_product.low_price
+    )
+    if previous_product is product:
+        apply_size_delta(product.pk, product.group_id, subtract(contribution, previous_contribution))
+    else:
+        apply_size_delta(previous_product.pk, previous_product.group_id, negate(previous_contribution))
+        apply_size_delta(product.pk, product.group_id, contribution)
+
+
+@receiver(post_delete, sender=ProductSize)
+def update_rollups_on_size_delete(sender, instance, origin=None, **kwargs):
+    # при каскадном удалении продукта или группы итоги поправит обработчик родителя
+    if not is_deleted_directly(origin, ProductSize):
+        return
+    product = instance.product
+    apply_size_delta(product.pk, product.group_id,
+                     negate(size_contribution(instance.have, instance.high_price, product.low_price)))
+
+
+@receiver(post_save, sender=Product)
+def update_rollups_on_product_save(sender, instance, created, raw=False, **kwargs):
+    """ Новый продукт, смена low_price или перенос продукта в другую группу """
+    if raw:
+        return
+    if created:
+        apply_delta(Group, instance.group_id, {'products_count': 1})
+        return
+    if not instance.has_changed('low_price') and not instance.has_changed('group'):
+        apply_delta(Group, instance.group_id, {})
+        return
+
+    # итоги читаем только когда они действительно нужны для пересчета
+    totals = Product.objects.filter(pk=instance.pk).values(*Product.rollup_fields).first()
+    price_delta = {}
+    low_price_change = instance.low_price - instance.get_previous_value('low_price')
+    if low_price_change:
+        # каждый размер стоит нам на low_price_change больше, проданные приносят на столько же меньше прибыли
+        price_delta = {
+            'spend': (totals['sold_count'] + totals['stock_count']) * low_price_change,
+            'profit': -totals['sold_count'] * low_price_change,
+        }
+        apply_delta(Product, instance.pk, price_delta)
+
+    previous_group_id = instance.get_previous_value('group')
+    if previous_group_id != instance.group_id:
+        # старая группа учитывала продукт по старой цене, новая получает его уже по новой
+        apply_delta(Group, previous_group_id, negate({**totals, 'products_count': 1}))
+        totals = {field: value + price_delta.get(field, 0) for field, value in totals.items()}
+        apply_delta(Group, instance.group_id, {**totals, 'products_count': 1})
+    else:
+        apply_delta(Group, instance.group_id, price_delta)
+
+
+@receiver(post_save, sender=Product)
+def rebuild_thumbnails_on_image_change(sender, instance, created, raw=False, **kwargs):
+    if raw or not (created or instance.has_changed('image')):
+        return
+    if not created:
+        # старые превью относятся к прежнему изображению
+        Product.objects.filter(pk=instance.pk).update(thumbnails={})
+        instance.thumbnails = {}
+    if instance.image:
+        schedule_thumbnails(instance)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_product_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and not {'product_name', 'article', 'description', 'group'} & set(update_fields)):
+        return
+    index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def update_search_index_on_product_delete(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def store_deleted_rollups(sender, instance, origin=None, **kwargs):
+    # читаем итоги до того, как каскадно удалятся размеры
+    if is_deleted_directly(origin, Product):
+        instance._deleted_rollups = Product.objects.filter(pk=instance.pk).values(*Product.rollup_fields).first()
+
+
+@receiver(post_delete, sender=Product)
+def update_rollups_on_product_delete(sender, instance, **kwargs):
+    totals = getattr(instance, '_deleted_rollups', None)
+    if totals is not None:
+        apply_delta(Group, instance.group_id, negate({**totals, 'products_count': 1}))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_group_versions(sender, instance, **kwargs):
+    bump_owner_versions(instance.owner_id, 'groups', 'history')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_versions(sender, instance, **kwargs):
+    bump_owner_versions(get_owner_id(Group, instance.group_id, 'owner_id'), 'groups', 'history')
+
+
+@receiver(post_save, sender=ProductSize)
+def bump_size_versions(sender, instance, **kwargs):
+    group_id = instance.product.group_id if 'product' in instance._state.fields_cache else \
+        Product.objects.filter(pk=instance.product_id).values_list('group_id', flat=True).first()
+    bump_owner_versions(get_owner_id(Group, group_id, 'owner_id'), 'groups', 'history')
+
+
+@receiver(post_delete, sender=ProductSize)
+def bump_size_versions_on_delete(sender, instance, origin=None, **kwargs):
+    # при каскадном удалении продукта или группы версии поднимет обработчик родителя,
+    # а SELECT группы на каждый размер был бы N+1
+    if is_deleted_directly(origin, ProductSize):
+        bump_size_versions(sender, instance)
+
+
+@receiver(post_save, sender=Seller)
+@receiver(post_delete, sender=Seller)
+def bump_seller_versions(sender, instance, **kwargs):
+    bump_owner_versions(instance.owner_id, 'sellers', 'history')
+
+
+@receiver(post_save, sender=HistoryItem)
+@receiver(post_delete, sender=HistoryItem)
+def bump_history_version(sender, instance, **kwargs):
+    # закрытые периоды аналитики и /history/ кешируются по версии истории
+    bump_owner_versions(get_owner_id(History, instance.history_id, 'user_id'), 'history')
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def bump_user_version(sender, instance, **kwargs):
+    # пользователь в CachedJWTAuthentication кешируется по этой версии: смена пароля, деактивация и удаление
+    # сразу действуют на уже выданные токены
+    bump_version('user', instance.pk)
@@ -1,3 +1,1298 @@
-from django.test import TestCase
+import csv
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Exists, Max, OuterRef
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_rest_passwordreset.models import ResetPasswordToken
+from openpyxl import Workbook, load_workbook
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from .images import build_thumbnails, build_thumbnails_in_background
+from .models import Group, HistoryItem, OutgoingEmail, Product, ProductSize, RevokedToken, Seller, UserProfile
+from .outbox import MAX_ATTEMPTS, send_queued_emails
+from .serializers import ProductSizeSellSerializer, VerifyResetCodeSerializer
+from .views import GroupListAPIView
 
-# Create your tests here.
+
+class OutgoingEmailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('seller', 'seller@example.com', 'secret-pass-123')
+
+    def test_password_reset_queues_one_email(self):
+        response = APIClient().post('/password_reset/', {'email': self.user.email}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.objects.filter(recipients=[self.user.email]).count(), 1)
+
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutgoingEmail.objects.get().status, 'sent')
+
+    def test_failed_email_is_retried_with_backoff(self):
+        email = OutgoingEmail.queue('Тема', 'Текст', [self.user.email])
+
+        with mock.patch('richman.outbox.EmailMessage.send', side_effect=OSError('smtp down')):
+            self.assertEqual(send_queued_emails(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('pending', 1, 'smtp down'))
+        # повтор еще не наступил
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    def test_email_fails_after_max_attempts(self):
+        email = OutgoingEmail.queue('Тема', 'Текст', [self.user.email])
+        OutgoingEmail.objects.filter(pk=email.pk).update(attempts=MAX_ATTEMPTS - 1)
+
+        with mock.patch('richman.outbox.EmailMessage.send', side_effect=OSError('smtp down')):
+            send_queued_emails()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'failed')
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        group = Group.objects.create(owner=self.user)
+        self.product = Product.objects.create(group=group, product_name='Кроссовки', low_price=100)
+
+    def test_group_list_is_served_from_cache_until_sizes_change(self):
+        self.client.get('/group/')
+        # остается только MAX(updated_date) для ETag
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/group/').data['results'][0]['count_all_sizes'], 0)
+
+        ProductSize.objects.create(product=self.product, size=40)
+
+        self.assertEqual(self.client.get('/group/').data['results'][0]['count_all_sizes'], 1)
+
+    def test_response_cached_before_commit_is_dropped_on_commit(self):
+        stale = self.client.get('/group/').data
+        request = SimpleNamespace(user=self.user, query_params=QueryDict())
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSize.objects.create(product=self.product, size=40)
+            # параллельный GET до коммита еще видел старые строки, но ключ строил уже по новой версии
+            cache.set(GroupListAPIView(kwargs={}).get_cache_key(request), stale)
+
+        self.assertEqual(self.client.get('/group/').data['results'][0]['count_all_sizes'], 1)
+
+
+class RollupTests(TestCase):
+    """ Итоги Product/Group, которые ведут сигналы, после каждой правки совпадают с пересчетом rebuild_rollups """
+
+    def setUp(self):
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.group = Group.objects.create(owner=self.user, group_date=date.today())
+        self.other_group = Group.objects.create(owner=self.user, group_date=date.today() - timedelta(days=1))
+        self.product = Product.objects.create(group=self.group, product_name='Кроссовки', low_price=100)
+        self.stock = ProductSize.objects.create(product=self.product, size=38)
+        ProductSize.objects.create(product=self.product, size=39)
+        self.sold = ProductSize.objects.create(product=self.product, size=40, have=False, high_price=150)
+
+    def assertTotals(self, obj, **expected):
+        obj.refresh_from_db()
+        self.assertEqual({field: getattr(obj, field) for field in expected}, expected)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_created_sizes(self):
+        totals = {'stock_count': 2, 'sold_count': 1, 'spend': 300, 'income': 150, 'profit': 50}
+        self.assertTotals(self.product, **totals)
+        self.assertTotals(self.group, products_count=1, **totals)
+
+    def test_size_edit(self):
+        self.stock.have, self.stock.high_price = False, 200
+        self.stock.save()
+        self.sold.high_price = 170
+        self.sold.save()
+
+        totals = {'stock_count': 1, 'sold_count': 2, 'spend': 300, 'income': 370, 'profit': 170}
+        self.assertTotals(self.product, **totals)
+        self.assertTotals(self.group, **totals)
+
+    def test_size_delete(self):
+        self.sold.delete()
+
+        totals = {'stock_count': 2, 'sold_count': 0, 'spend': 200, 'income': 0, 'profit': 0}
+        self.assertTotals(self.product, **totals)
+        self.assertTotals(self.group, **totals)
+
+    def test_low_price_change(self):
+        self.product.low_price = 120
+        self.product.save()
+
+        totals = {'stock_count': 2, 'sold_count': 1, 'spend': 360, 'income': 150, 'profit': 30}
+        self.assertTotals(self.product, **totals)
+        self.assertTotals(self.group, **totals)
+
+    def test_product_moved_to_other_group(self):
+        self.product.group = self.other_group
+        self.product.low_price = 120
+        self.product.save()
+
+        self.assertTotals(self.group, products_count=0, stock_count=0, sold_count=0, spend=0, income=0, profit=0)
+        self.assertTotals(self.other_group, products_count=1, stock_count=2, sold_count=1, spend=360, income=150,
+                          profit=30)
+
+    def test_product_delete(self):
+        Product.objects.create(group=self.group, product_name='Кеды', low_price=50)
+        self.product.delete()
+
+        self.assertTotals(self.group, products_count=1, stock_count=0, sold_count=0, spend=0, income=0, profit=0)
+
+    def test_repaired_totals_reach_cached_responses(self):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        Group.objects.filter(pk=self.group.pk).update(spend=1)
+        Product.objects.filter(pk=self.product.pk).update(spend=1)
+        urls = ('/group/', f'/group/{self.group.pk}/')
+        etags = {url: client.get(url)['ETag'] for url in urls}
+        self.assertEqual(client.get('/group/').data['results'][0]['group_spend'], 1)
+        self.assertEqual(client.get(urls[1]).data['products'][0]['products_spend'], 1)
+
+        call_command('rebuild_rollups', stdout=StringIO())
+
+        for url in urls:
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 200)
+        self.assertEqual(client.get('/group/').data['results'][0]['group_spend'], 300)
+        self.assertEqual(client.get(urls[1]).data['products'][0]['products_spend'], 300)
+
+    def test_group_cascade_delete(self):
+        other = Product.objects.create(group=self.other_group, product_name='Кеды', low_price=50)
+        ProductSize.objects.create(product=other, size=41)
+
+        # продукты и размеры удаляются каскадом, итоги других групп не трогаются
+        self.group.delete()
+
+        self.assertFalse(ProductSize.objects.filter(product=self.product).exists())
+        self.assertTotals(self.other_group, products_count=1, stock_count=1, sold_count=0, spend=50, income=0,
+                          profit=0)
+
+
+class BulkSizeCreateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.group = Group.objects.create(owner=self.user)
+        self.product = Product.objects.create(group=self.group, product_name='Кроссовки', low_price=100)
+        self.url = f'/product/{self.product.pk}/size/create/'
+
+    def test_quantity_is_expanded_and_totals_updated(self):
+        response = self.client.post(self.url, [
+            {'size': 38, 'quantity': 3},
+            {'size': 39},
+            {'size': 40, 'have': False, 'high_price': 150},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(sorted(self.product.sizes.values_list('size', flat=True)), [38, 38, 38, 39, 40])
+        totals = {'stock_count': 4, 'sold_count': 1, 'spend': 500, 'income': 150, 'profit': 50}
+        for obj in (self.product, self.group):
+            obj.refresh_from_db()
+            self.assertEqual({field: getattr(obj, field) for field in totals}, totals)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_at_most_500_sizes_per_request(self):
+        response = self.client.post(self.url, [{'size': 38, 'quantity': 400}, {'size': 39, 'quantity': 101}],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ProductSize.objects.exists())
+
+        response = self.client.post(self.url, [{'size': 38, 'quantity': 400}, {'size': 39, 'quantity': 100}],
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ProductSize.objects.count(), 500)
+
+    def test_invalid_item_rejects_whole_list(self):
+        response = self.client.post(self.url, [{'size': 38}, {'size': 39, 'quantity': 0}], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ProductSize.objects.exists())
+
+
+class FieldTrackerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(group=Group.objects.create(owner=self.user), product_name='Кроссовки',
+                                              low_price=100)
+        self.size = ProductSize.objects.create(product=self.product, size=40)
+
+    def patch(self, data):
+        response = self.client.patch(f'/size/{self.size.pk}/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_size_patch_does_not_reread_size(self):
+        self.patch({'have': False, 'high_price': 150})
+        self.patch({'have': True, 'high_price': None})
+
+        # SELECT размера (get_object), UPDATE, History, HistoryItem, итоги продукта и группы и savepoint —
+        # ни владельца, ни повторного чтения размера перед сохранением
+        with CaptureQueriesContext(connection) as context:
+            self.patch({'have': False, 'high_price': 150})
+        self.assertEqual(len(context), 8, '\n'.join(query['sql'] for query in context.captured_queries))
+        size_selects = [query['sql'] for query in context.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "richman_productsize"' in query['sql']]
+        self.assertEqual(len(size_selects), 1)
+        self.assertEqual(HistoryItem.objects.filter(product_size=self.size).count(), 1)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_hand_built_instance_reads_previous_values_once(self):
+        size = ProductSize(pk=self.size.pk, product=self.product, size=40, have=False, high_price=150)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(size.get_previous_value('have'))
+        with self.assertNumQueries(0):
+            self.assertTrue(size.has_changed('high_price'))
+            self.assertFalse(size.has_changed('product'))
+
+        size.save()
+        self.assertEqual(HistoryItem.objects.filter(product_size=self.size).count(), 1)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+
+class SellTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.seller = Seller.objects.create(seller_name='Айбек', owner=self.user)
+        product = Product.objects.create(group=Group.objects.create(owner=self.user), product_name='Кроссовки',
+                                         low_price=100)
+        self.first = ProductSize.objects.create(product=product, size=38)
+        self.second = ProductSize.objects.create(product=product, size=39)
+
+    def sell(self, *sizes, high_price=150, seller=None):
+        return self.client.post('/size/sell/', [
+            {'size_id': size.pk, 'high_price': high_price, 'seller': seller or self.seller.pk} for size in sizes
+        ], format='json')
+
+    def test_already_sold_sizes_are_reported(self):
+        self.assertEqual(self.sell(self.first).data, {'sold': [self.first.pk], 'already_sold': []})
+
+        response = self.sell(self.first, self.second)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'sold': [self.second.pk], 'already_sold': [self.first.pk]})
+        self.assertEqual(HistoryItem.objects.filter(product_size=self.first).count(), 1)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_size_sold_after_validation_is_not_sold_twice(self):
+        serializer = ProductSizeSellSerializer(
+            data=[{'size_id': size.pk, 'high_price': 150} for size in (self.first, self.second)],
+            many=True, context={'request': SimpleNamespace(user=self.user)},
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # параллельная продажа между проверкой и записью
+        self.first.have, self.first.high_price = False, 200
+        self.first.save()
+
+        self.assertEqual(serializer.save(), {'sold': [self.second.pk], 'already_sold': [self.first.pk]})
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.high_price, 200)
+        self.assertEqual(HistoryItem.objects.filter(product_size=self.first).count(), 1)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    @mock.patch('richman.db.supports_update_returning', return_value=False)
+    def test_sell_without_update_returning(self, supports_update_returning):
+        # SQLite 3.31–3.34: RETURNING нет, продаем по одной строке
+        self.assertEqual(self.sell(self.first).data, {'sold': [self.first.pk], 'already_sold': []})
+        self.assertEqual(self.sell(self.first, self.second, high_price=170).data,
+                         {'sold': [self.second.pk], 'already_sold': [self.first.pk]})
+
+        self.assertTrue(supports_update_returning.called)
+        self.assertEqual(dict(ProductSize.objects.values_list('pk', 'high_price')),
+                         {self.first.pk: 150, self.second.pk: 170})
+        self.assertEqual(HistoryItem.objects.count(), 2)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_foreign_sizes_and_sellers_are_rejected(self):
+        stranger = UserProfile.objects.create_user('stranger', 'stranger@example.com', 'secret-pass-123')
+        foreign_seller = Seller.objects.create(seller_name='Нурлан', owner=stranger)
+        foreign_size = ProductSize.objects.create(size=40, product=Product.objects.create(
+            group=Group.objects.create(owner=stranger), product_name='Кеды', low_price=100,
+        ))
+
+        self.assertEqual(self.sell(self.first, foreign_size).status_code, 400)
+        self.assertEqual(self.sell(self.first, seller=foreign_seller.pk).status_code, 400)
+        self.assertFalse(ProductSize.objects.filter(have=False).exists())
+
+    def test_high_price_below_low_price_is_rejected(self):
+        response = self.sell(self.first, high_price=99)
+
+        self.assertEqual(response.status_code, 400)
+        self.first.refresh_from_db()
+        self.assertTrue(self.first.have)
+
+
+def image_upload(name='photo.png', size=(800, 400), color='red'):
+    file = BytesIO()
+    Image.new('RGB', size, color).save(file, 'PNG')
+    return SimpleUploadedFile(name, file.getvalue(), content_type='image/png')
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.group = Group.objects.create(owner=self.user)
+        # превью строятся в пуле потоков после коммита: в тестах проверяем постановку задачи,
+        # а build_thumbnails вызываем сами
+        with self.schedule() as executor:
+            self.product = Product.objects.create(group=self.group, product_name='Кроссовки', low_price=100,
+                                                  image=image_upload())
+        executor.submit.assert_called_once_with(build_thumbnails_in_background, self.product.pk)
+
+    @contextmanager
+    def schedule(self):
+        with mock.patch('richman.images.executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            yield executor
+
+    def test_derivatives_are_built(self):
+        thumbnails = build_thumbnails(self.product)
+
+        self.assertEqual({name: set(paths) for name, paths in thumbnails.items()},
+                         {'small': {'webp', 'jpeg'}, 'medium': {'webp', 'jpeg'}})
+        with default_storage.open(thumbnails['small']['webp']) as file:
+            self.assertEqual(Image.open(file).size, (200, 100))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.thumbnails, thumbnails)
+
+    def test_replacing_image_clears_stale_thumbnails(self):
+        build_thumbnails(self.product)
+        self.product.refresh_from_db()
+
+        with self.schedule() as executor:
+            self.product.image = image_upload('other.png', color='blue')
+            self.product.save()
+
+        executor.submit.assert_called_once_with(build_thumbnails_in_background, self.product.pk)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.thumbnails, {})
+        self.assertTrue(build_thumbnails(self.product)['small']['jpeg'].startswith('product_image/thumbs/other'))
+
+    def test_build_invalidates_cached_responses(self):
+        url = f'/group/{self.group.pk}/'
+        response = self.client.get(url)
+        self.assertIsNone(response.data['products'][0]['thumbnails'])
+
+        build_thumbnails(self.product)
+
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(set(second.data['products'][0]['thumbnails']), {'small', 'medium'})
+
+    def test_backfill_command(self):
+        broken = Product.objects.create(group=self.group, product_name='Кеды', low_price=100)
+        Product.objects.filter(pk=broken.pk).update(image='product_image/missing.png')
+
+        errors = StringIO()
+        call_command('build_thumbnails', stdout=StringIO(), stderr=errors)
+        self.product.refresh_from_db()
+        self.assertEqual(set(self.product.thumbnails), {'small', 'medium'})
+        self.assertIn(f'#{broken.pk}', errors.getvalue())
+
+        # уже готовые превью без --all не пересоздаются
+        output = StringIO()
+        call_command('build_thumbnails', stdout=output, stderr=StringIO())
+        self.assertIn('Превью готовы: 0, с ошибкой: 1', output.getvalue())
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.group = Group.objects.create(owner=self.user)
+        self.product = Product.objects.create(group=self.group, product_name='Кроссовки', low_price=100)
+
+    def add_size(self):
+        response = self.client.post(f'/product/{self.product.pk}/size/create/', {'size': 40}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_not_modified_until_child_changes(self):
+        for url in (f'/product/{self.product.pk}/', f'/group/{self.group.pk}/'):
+            etag = self.client.get(url)['ETag']
+            # одно чтение updated_date, без сериализации
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            self.add_size()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since_does_not_hide_change_in_same_second(self):
+        url = f'/product/{self.product.pk}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        self.add_size()
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['sizes']), 1)
+
+    def test_foreign_objects_are_not_found(self):
+        etag = self.client.get(f'/product/{self.product.pk}/')['ETag']
+        stranger = UserProfile.objects.create_user('stranger', 'stranger@example.com', 'secret-pass-123')
+        self.client.force_authenticate(stranger)
+        for url in (f'/product/{self.product.pk}/', f'/group/{self.group.pk}/'):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 404)
+            self.assertNotIn('ETag', response)
+
+
+def seed_account(owner, groups=3, products=5, sizes=(38, 39, 40, 41)):
+    """ Аккаунт продавца: группы поставок с продуктами, размерами, продавцами и продажами """
+    seller = Seller.objects.create(seller_name='Айбек', owner=owner)
+    client = APIClient()
+    client.force_authenticate(owner)
+    for day in range(groups):
+        group = Group.objects.create(owner=owner, group_date=date.today() - timedelta(days=day))
+        for number in range(products):
+            product = Product.objects.create(group=group, product_name=f'Модель {number}',
+                                             article=f'A-{day}-{number}', low_price=1000)
+            client.post(f'/product/{product.pk}/size/create/', [{'size': size} for size in sizes], format='json')
+    # продаем половину размеров
+    sold = ProductSize.objects.filter(product__group__owner=owner, size__in=sizes[::2])
+    client.post('/size/sell/', [{'size_id': size.pk, 'high_price': 1500, 'seller': seller.pk} for size in sold],
+                format='json')
+    return client
+
+
+class GroupFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        cls.cheap = Group.objects.create(owner=cls.user, group_date=date.today())
+        cls.expensive = Group.objects.create(owner=cls.user, group_date=date.today() - timedelta(days=1))
+        cheap = Product.objects.create(group=cls.cheap, product_name='Кроссовки', article='K-1', low_price=1000)
+        expensive = Product.objects.create(group=cls.expensive, product_name='Ботинки', article='B-1', low_price=5000)
+        ProductSize.objects.create(product=cheap, size=38)
+        ProductSize.objects.create(product=cheap, size=39, have=False, high_price=1500)
+        ProductSize.objects.create(product=expensive, size=40)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_ids(self, params):
+        response = self.client.get('/group/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {group['id'] for group in response.data['results']}
+
+    def test_size_list_matches_only_sizes_in_stock(self):
+        self.assertEqual(self.get_ids({'size': '38,40'}), {self.cheap.pk, self.expensive.pk})
+        self.assertEqual(self.get_ids({'size': '39'}), set())
+        self.assertEqual(self.get_ids({'size': '39', 'have': 'false'}), {self.cheap.pk})
+        # старое имя параметра
+        self.assertEqual(self.get_ids({'products__sizes__size': '40'}), {self.expensive.pk})
+
+    def test_product_conditions_apply_to_the_same_product(self):
+        self.assertEqual(self.get_ids({'price_max': 2000}), {self.cheap.pk})
+        self.assertEqual(self.get_ids({'price_min': 2000, 'search': 'Ботинки'}), {self.expensive.pk})
+        self.assertEqual(self.get_ids({'size': '38', 'search': 'Ботинки'}), set())
+
+    def test_groups_are_not_duplicated(self):
+        response = self.client.get('/group/', {'have': 'true'})
+        self.assertEqual([group['id'] for group in response.data['results']], [self.cheap.pk, self.expensive.pk])
+
+
+class ListPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.groups = [Group.objects.create(owner=self.user, group_date=date.today() - timedelta(days=day))
+                       for day in range(5)]
+
+    def test_groups_are_paged_newest_first(self):
+        ids, url = [], '/group/?page_size=2'
+        while url:
+            data = self.client.get(url).data
+            ids += [group['id'] for group in data['results']]
+            url = data['next']
+        self.assertEqual(ids, [group.pk for group in self.groups])
+
+    def test_count_is_cached_until_data_changes(self):
+        self.assertEqual(self.client.get('/seller/', {'count': 'true'}).data['count'], 0)
+        # другой размер страницы — другой ответ, но то же количество: COUNT(*) берется из кеша
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/seller/', {'count': 'true', 'page_size': 10}).data['count'], 0)
+
+        Seller.objects.create(seller_name='Айбек', owner=self.user)
+
+        self.assertEqual(self.client.get('/seller/', {'count': 'true'}).data['count'], 1)
+        self.assertNotIn('count', self.client.get('/seller/').data)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5-индекс есть только на SQLite')
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # id групп повторяются между тестами, а владелец группы кешируется навсегда
+        cache.clear()
+        cls.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        other = UserProfile.objects.create_user('other', 'other@example.com', 'secret-pass-123')
+        group = Group.objects.create(owner=cls.user, group_date=date.today())
+        cls.sneakers = Product.objects.create(group=group, product_name='Кроссовки беговые', article='NK-2041',
+                                              low_price=1000)
+        cls.boots = Product.objects.create(group=group, product_name='Ботинки', article='TB-77', low_price=3000,
+                                           description='Подходят к кроссовкам и костюмам')
+        other_group = Group.objects.create(owner=other, group_date=date.today())
+        Product.objects.create(group=other_group, product_name='Кроссовки', article='NK-2042', low_price=1000)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, text, **params):
+        response = self.client.get('/product/search/', {'q': text, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [product['id'] for product in response.data['results']]
+
+    def test_prefix_match_on_article_is_scoped_to_owner(self):
+        self.assertEqual(self.search('nk-20'), [self.sneakers.pk])
+
+    def test_name_match_ranks_above_description(self):
+        self.assertEqual(self.search('кросс'), [self.sneakers.pk, self.boots.pk])
+        self.assertEqual(self.search('кросс', page_size=1), [self.sneakers.pk])
+
+    def test_index_follows_product_changes(self):
+        self.boots.article = 'TB-99'
+        self.boots.save()
+        self.assertEqual(self.search('TB-77'), [])
+        self.assertEqual(self.search('tb-99'), [self.boots.pk])
+
+        self.sneakers.delete()
+        self.assertEqual(self.search('кросс'), [self.boots.pk])
+
+    def test_rebuild_command_restores_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM richman_product_fts')
+        self.assertEqual(self.search('ботинки'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('ботинки'), [self.boots.pk])
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for day in range(2):
+            group = Group.objects.create(owner=self.user, group_date=date.today() - timedelta(days=day))
+            product = Product.objects.create(group=group, product_name='Кроссовки', article='NK-1', low_price=1000)
+            for size in (40, 41):
+                ProductSize.objects.create(product=product, size=size)
+        boots = Product.objects.create(group=group, product_name='Ботинки', low_price=3000)
+        ProductSize.objects.create(product=boots, size=41)
+        ProductSize.objects.create(product=boots, size=42, have=False, high_price=3500)
+
+    def test_counts_sizes_in_stock_across_groups(self):
+        data = self.client.get('/inventory/').data
+
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['sizes'], [{'size': 40, 'count': 2}, {'size': 41, 'count': 3}])
+        self.assertEqual(data['products'], [
+            {'article': None, 'product_name': 'Ботинки', 'count': 1, 'sizes': [{'size': 41, 'count': 1}]},
+            {'article': 'NK-1', 'product_name': 'Кроссовки', 'count': 4,
+             'sizes': [{'size': 40, 'count': 2}, {'size': 41, 'count': 2}]},
+        ])
+
+    def test_size_filter_and_cache_invalidation(self):
+        self.assertEqual(self.client.get('/inventory/', {'size': '41'}).data['count'], 3)
+
+        ProductSize.objects.filter(size=41).first().delete()
+
+        self.assertEqual(self.client.get('/inventory/', {'size': '41'}).data['count'], 2)
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.aibek = Seller.objects.create(seller_name='Айбек', owner=self.user)
+        self.nurlan = Seller.objects.create(seller_name='Нурлан', owner=self.user)
+        self.product = Product.objects.create(group=Group.objects.create(owner=self.user),
+                                              product_name='Кроссовки', low_price=100)
+        # 2024-01-01 — понедельник; время в Asia/Bishkek (UTC+6)
+        self.sell(38, 150, self.aibek, timezone.make_aware(datetime(2024, 1, 1, 10)))
+        self.undone = self.sell(39, 180, self.nurlan, timezone.make_aware(datetime(2024, 1, 3, 12)))
+        # по UTC еще 7 января (воскресенье), по местному времени уже 8-е
+        self.sell(38, 200, self.aibek, datetime(2024, 1, 7, 20, tzinfo=dt_timezone.utc))
+        self.sell(40, 120, None, timezone.make_aware(datetime(2024, 2, 5, 9)))
+
+        stranger = UserProfile.objects.create_user('stranger', 'stranger@example.com', 'secret-pass-123')
+        size = ProductSize.objects.create(size=38, product=Product.objects.create(
+            group=Group.objects.create(owner=stranger), product_name='Кеды', low_price=100,
+        ))
+        size.have, size.high_price = False, 500
+        size.save()
+
+    def sell(self, size, high_price, seller, sold_date):
+        size = ProductSize.objects.create(product=self.product, size=size)
+        size.have, size.high_price, size.seller = False, high_price, seller
+        size.save()
+        HistoryItem.objects.filter(product_size=size).update(sold_date=sold_date)
+        return size
+
+    def get(self, **params):
+        return self.client.get('/analytics/sales/', params)
+
+    def bucket(self, period, units, income, cost):
+        return {'period': period, 'units': units, 'income': income, 'cost': cost, 'profit': income - cost}
+
+    def test_day_buckets_follow_local_time(self):
+        self.assertEqual(self.get(sold_date__gte='2024-01-01').data, [
+            self.bucket('01-01-2024', 1, 150, 100),
+            self.bucket('03-01-2024', 1, 180, 100),
+            self.bucket('08-01-2024', 1, 200, 100),
+            self.bucket('05-02-2024', 1, 120, 100),
+        ])
+
+    def test_week_and_month_buckets(self):
+        self.assertEqual(self.get(period='week').data, [
+            self.bucket('01-01-2024', 2, 330, 200),
+            self.bucket('08-01-2024', 1, 200, 100),
+            self.bucket('05-02-2024', 1, 120, 100),
+        ])
+        self.assertEqual(self.get(period='month').data, [
+            self.bucket('01-01-2024', 3, 530, 300),
+            self.bucket('01-02-2024', 1, 120, 100),
+        ])
+
+    def test_seller_size_and_date_filters(self):
+        self.assertEqual(self.get(period='month', seller=self.aibek.pk).data,
+                         [self.bucket('01-01-2024', 2, 350, 200)])
+        self.assertEqual(self.get(period='month', size=39).data, [self.bucket('01-01-2024', 1, 180, 100)])
+        # границы — местные сутки: продажа 7 января 20:00 UTC относится к 8-му
+        self.assertEqual(self.get(sold_date__gte='2024-01-08', sold_date__lte='2024-01-08').data,
+                         [self.bucket('08-01-2024', 1, 200, 100)])
+        self.assertEqual(self.get(period='month', sold_date__lte='2024-01-07').data,
+                         [self.bucket('01-01-2024', 2, 330, 200)])
+
+    def test_invalid_period_is_rejected(self):
+        response = self.get(period='year')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('period', response.data)
+
+    def test_closed_period_is_cached_until_a_sale_is_undone(self):
+        expected = [self.bucket('01-01-2024', 3, 530, 300)]
+        self.assertEqual(self.get(period='month', sold_date__lte='2024-01-31').data, expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(period='month', sold_date__lte='2024-01-31').data, expected)
+
+        # возврат размера в наличие удаляет продажу из истории
+        size = ProductSize.objects.get(pk=self.undone.pk)
+        size.have = True
+        size.save()
+
+        self.assertEqual(self.get(period='month', sold_date__lte='2024-01-31').data,
+                         [self.bucket('01-01-2024', 2, 350, 200)])
+
+
+class HistoryItemListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.seller = Seller.objects.create(seller_name='Айбек', owner=self.user)
+        self.product = Product.objects.create(group=Group.objects.create(owner=self.user),
+                                              product_name='Кроссовки', low_price=100)
+
+        stranger = UserProfile.objects.create_user('stranger', 'stranger@example.com', 'secret-pass-123')
+        size = ProductSize.objects.create(size=38, product=Product.objects.create(
+            group=Group.objects.create(owner=stranger), product_name='Кеды', low_price=100,
+        ))
+        size.have, size.high_price = False, 999
+        size.save()
+
+    def sell(self, high_price, sold_date, size=38, seller=None):
+        size = ProductSize.objects.create(product=self.product, size=size)
+        size.have, size.high_price, size.seller = False, high_price, seller
+        size.save()
+        HistoryItem.objects.filter(product_size=size).update(sold_date=sold_date)
+
+    def prices(self, **params):
+        return [item['product_size']['high_price'] for item in
+                self.client.get('/history/items/', params).data['results']]
+
+    def test_cursor_pages_have_no_duplicates_or_gaps(self):
+        # одинаковое время у части продаж: порядок внутри них держит id
+        same_time = timezone.make_aware(datetime(2024, 1, 5, 12))
+        for price in range(101, 105):
+            self.sell(price, same_time)
+        for day, price in ((4, 105), (6, 106), (3, 107)):
+            self.sell(price, timezone.make_aware(datetime(2024, 1, day, 12)))
+
+        prices, url = [], '/history/items/?page_size=3'
+        while url:
+            data = self.client.get(url).data
+            self.assertLessEqual(len(data['results']), 3)
+            prices += [item['product_size']['high_price'] for item in data['results']]
+            url = data['next']
+
+        self.assertEqual(prices, [106, 104, 103, 102, 101, 105, 107])
+
+    def test_sold_date_lte_includes_the_whole_local_day(self):
+        self.sell(101, timezone.make_aware(datetime(2024, 1, 5, 23, 30)))
+        self.sell(102, timezone.make_aware(datetime(2024, 1, 6, 0, 10)))
+        # по UTC еще 5 января, по местному времени уже 6-е
+        self.sell(103, datetime(2024, 1, 5, 20, tzinfo=dt_timezone.utc))
+        self.sell(104, timezone.make_aware(datetime(2024, 1, 5, 0, 0)))
+
+        self.assertEqual(self.prices(sold_date__lte='2024-01-05'), [101, 104])
+        self.assertEqual(self.prices(sold_date__gte='2024-01-06'), [103, 102])
+
+    def test_seller_and_size_filters(self):
+        sold_date = timezone.make_aware(datetime(2024, 1, 5, 12))
+        self.sell(101, sold_date, size=38, seller=self.seller)
+        self.sell(102, sold_date, size=39, seller=self.seller)
+        self.sell(103, sold_date, size=39)
+
+        self.assertEqual(self.prices(seller=self.seller.pk), [102, 101])
+        self.assertEqual(self.prices(size=39), [103, 102])
+        self.assertEqual(self.prices(seller=self.seller.pk, size=39), [102])
+
+    def test_only_own_sales_are_listed(self):
+        self.sell(101, timezone.make_aware(datetime(2024, 1, 5, 12)))
+
+        self.assertEqual(self.prices(), [101])
+
+
+class GenerateDataTests(TestCase):
+    def test_generated_accounts_are_consistent_and_benchmarkable(self):
+        call_command('generate_data', users=2, groups=3, products=4, sizes=5, seed=1, stdout=StringIO())
+
+        self.assertEqual(ProductSize.objects.count(), 2 * 3 * 4 * 5)
+        self.assertEqual(HistoryItem.objects.count(), ProductSize.objects.filter(have=False).count())
+        # итоги, записанные генератором, совпадают с пересчетом по таблице размеров
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+        output = StringIO()
+        call_command('benchmark', requests=2, warmup=0, endpoint=['group_list', 'inventory'], stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['endpoints']['group_list']['status'], [200])
+        self.assertGreater(report['endpoints']['inventory']['bytes'], 0)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        Group.objects.create(owner=self.user, group_date=date.today())
+
+    def get_client(self):
+        # middleware подключается при первом запросе клиента, уже с переопределенными настройками
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.get_client().get('/group/'))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_REQUEST_MS=0)
+    def test_server_timing_and_slow_log(self):
+        with self.assertLogs('richman.slow_requests', 'WARNING') as logs:
+            response = self.get_client().get('/group/')
+
+        timings = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        self.assertEqual(timings, ['db', 'view', 'render', 'total'])
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['path'], entry['status'], entry['user']), ('/group/', 200, self.user.pk))
+        self.assertEqual(entry['queries'], sum(statement['count'] for statement in entry['sql']))
+        self.assertIn('richman_group', entry['sql'][0]['sql'])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        client = seed_account(cls.user, groups=2, products=2, sizes=(40, 41))
+        cls.seller = Seller.objects.create(seller_name='Нурлан', owner=cls.user)
+        size = ProductSize.objects.filter(product__group__owner=cls.user, have=True).first()
+        client.post('/size/sell/', [{'size_id': size.pk, 'high_price': 2000, 'seller': cls.seller.pk}],
+                    format='json')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_csv(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(StringIO(content)))
+
+    def test_history_csv_uses_history_filters(self):
+        rows = self.read_csv('/history/export/')
+        self.assertEqual(rows[0][:3], ['Дата продажи', 'Продукт', 'Артикул'])
+        self.assertEqual(len(rows) - 1, HistoryItem.objects.count())
+
+        rows = self.read_csv('/history/export/', {'seller': self.seller.pk})
+        self.assertEqual([row[5:] for row in rows[1:]], [['2000', '1000', 'Нурлан']])
+        self.assertEqual(len(self.read_csv('/history/export/', {'sold_date__lte': '2000-01-01'})), 1)
+
+    def test_group_report_csv(self):
+        rows = self.read_csv('/group/export/', {'group_date__gte': date.today().isoformat()})
+        self.assertEqual(rows[1], [date.today().isoformat(), '2', '3', '1', '4000', '5000', '2000'])
+        self.assertEqual(len(rows), 2)
+
+    def test_unknown_type_is_rejected(self):
+        self.assertEqual(self.client.get('/history/export/', {'type': 'pdf'}).status_code, 400)
+
+    def test_xlsx_matches_csv(self):
+        for url in ('/history/export/', '/group/export/'):
+            response = self.client.get(url, {'type': 'xlsx'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('.xlsx', response['Content-Disposition'])
+            sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True).active
+            rows = [['' if value is None else str(value) for value in row] for row in sheet.iter_rows(values_only=True)]
+            # даты в XLSX — ячейки даты/времени (с точностью до миллисекунд), сверяем только день
+            self.assertEqual([[row[0][:10]] + row[1:] for row in rows],
+                             [[row[0][:10]] + row[1:] for row in self.read_csv(url)])
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.group = Group.objects.create(owner=self.user, group_date=date.today())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/group/{self.group.pk}/product/import/'
+
+    def upload(self, content, name='invoice.csv', encoding='utf-8'):
+        file = SimpleUploadedFile(name, content.encode(encoding), content_type='text/csv')
+        return self.client.post(self.url, {'file': file}, format='multipart')
+
+    def test_import_creates_products_sizes_and_totals(self):
+        response = self.upload(
+            'product_name;article;low_price;sizes\n'
+            'Кроссовки;NK-1;1000;38, 39x2, 40\n'
+            '\n'
+            'Ботинки;;2500;41\n',
+            encoding='cp1251',
+        )
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data, {'products': 2, 'sizes': 5})
+        self.group.refresh_from_db()
+        self.assertEqual((self.group.products_count, self.group.stock_count, self.group.spend), (2, 5, 6500))
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).data['status'], 'done')
+        self.assertEqual(self.client.get('/product/search/', {'q': 'nk-1'}).data['count'], 1)
+
+    def test_xlsx_import(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Product_Name', 'Article', 'Low_Price', 'Sizes', 'Description'])
+        sheet.append(['Кроссовки', 'NK-1', 1000, '38, 39x2', None])
+        # числовые ячейки openpyxl отдает как int/float
+        sheet.append(['Ботинки', None, 2500.0, 41, 'Зимние'])
+        file = BytesIO()
+        workbook.save(file)
+
+        response = self.client.post(self.url, {'file': SimpleUploadedFile('invoice.xlsx', file.getvalue())},
+                                    format='multipart')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data, {'products': 2, 'sizes': 4})
+        self.assertEqual(Product.objects.get(article='NK-1').sizes.count(), 3)
+        self.assertEqual(Product.objects.get(product_name='Ботинки').description, 'Зимние')
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_row_errors_are_reported_and_nothing_is_imported(self):
+        response = self.upload(
+            'product_name,low_price,sizes\n'
+            'Кроссовки,1000,38\n'
+            ',abc,38\n'
+            'Ботинки,2500,41x0 big\n'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([row['row'] for row in response.data['rows']], [3, 4])
+        self.assertEqual(set(response.data['rows'][0]['errors']), {'product_name', 'low_price'})
+        self.assertEqual(len(response.data['rows'][1]['errors']['sizes']), 2)
+        self.assertFalse(Product.objects.exists())
+
+    def test_missing_columns_and_foreign_group(self):
+        self.assertIn('sizes', self.upload('product_name,low_price\nКроссовки,1000\n').data['detail'])
+        other = UserProfile.objects.create_user('other', 'other@example.com', 'secret-pass-123')
+        self.url = f'/group/{Group.objects.create(owner=other, group_date=date.today()).pk}/product/import/'
+        self.assertEqual(self.upload('product_name,low_price,sizes\nКроссовки,1000,38\n').status_code, 404)
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_user_is_read_once_per_version(self):
+        self.client.get('/seller/')
+        # ответ /seller/ тоже в кеше, поэтому запросов к базе нет совсем
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/seller/').status_code, 200)
+
+        self.user.first_name = 'Айбек'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.client.get('/seller/')
+
+    def test_password_reset_and_deactivation_invalidate_cached_user(self):
+        self.client.get('/seller/')
+        token = ResetPasswordToken.objects.create(user=self.user, key='1234')
+        serializer = VerifyResetCodeSerializer(data={'email': self.user.email, 'reset_code': token.key,
+                                                     'new_password': 'new-secret-pass-456'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        with self.assertNumQueries(1):
+            self.client.get('/seller/')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/seller/').status_code, 401)
+
+
+class OwnerScopeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        other = UserProfile.objects.create_user('other', 'other@example.com', 'secret-pass-123')
+        seed_account(other, groups=1, products=1, sizes=(40,))
+        cls.group = Group.objects.get(owner=other)
+        cls.product = cls.group.products.get()
+        cls.size = cls.product.sizes.get()
+        cls.seller = Seller.objects.get(owner=other)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_foreign_objects_are_not_found(self):
+        for url in (f'/group/{self.group.pk}/', f'/seller/{self.seller.pk}/', f'/product/{self.product.pk}/',
+                    f'/size/{self.size.pk}/'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+            self.assertEqual(self.client.patch(url, {}, format='json').status_code, 404 if 'group' not in url
+                             else 405, url)
+        self.assertEqual(self.client.delete(f'/product/{self.product.pk}/').status_code, 404)
+        self.assertEqual(self.client.delete(f'/size/{self.size.pk}/').status_code, 404)
+        self.assertTrue(ProductSize.objects.filter(pk=self.size.pk).exists())
+
+    def test_anonymous_requests_are_rejected(self):
+        self.assertEqual(APIClient().get(f'/product/{self.product.pk}/').status_code, 401)
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+        tokens = self.client.post('/login/', {'username': 'owner', 'password': 'secret-pass-123'}).data
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+
+    def refresh_token(self, refresh):
+        return self.client.post('/api/token/refresh/', {'refresh': refresh})
+
+    def test_rotated_refresh_token_cannot_be_reused(self):
+        response = self.refresh_token(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['refresh'], self.refresh)
+
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+        # кеш потерян: отзыв все равно виден через базу
+        cache.clear()
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+        self.assertEqual(self.refresh_token(response.data['refresh']).status_code, 200)
+
+    def test_logout_revokes_refresh_and_access_tokens(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(self.client.get('/seller/').status_code, 200)
+
+        self.assertEqual(self.client.post('/logout/', {'refresh': self.refresh}).status_code, 205)
+
+        self.assertEqual(self.client.get('/seller/').status_code, 401)
+        # отметки в кеше вытеснены (LocMem cull, benchmark --cold) — отзыв держится на отметке в базе
+        cache.clear()
+        self.assertEqual(self.client.get('/seller/').status_code, 401)
+        self.client.credentials()
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+        self.assertEqual(self.client.post('/logout/', {'refresh': self.refresh}).status_code, 400)
+
+        # новый вход после выхода работает
+        response = self.client.post('/login/', {'username': 'owner', 'password': 'secret-pass-123'})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        self.assertEqual(self.client.get('/seller/').status_code, 200)
+
+    def test_logout_revokes_access_tokens_of_other_sessions(self):
+        # токен с другого устройства, выданный раньше выхода
+        other = RefreshToken.for_user(self.user).access_token
+        other['iat'] = int((timezone.now() - timedelta(minutes=1)).timestamp())
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other}')
+        self.assertEqual(self.client.get('/seller/').status_code, 200)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(self.client.post('/logout/', {'refresh': self.refresh}).status_code, 205)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other}')
+        self.assertEqual(self.client.get('/seller/').status_code, 401)
+
+    def test_purge_removes_only_expired_rows(self):
+        self.refresh_token(self.refresh)
+        RevokedToken.objects.create(jti='old', expires_date=timezone.now() - timedelta(minutes=1))
+
+        call_command('purge_revoked_tokens', stdout=StringIO())
+
+        self.assertEqual(list(RevokedToken.objects.values_list('user', flat=True)), [self.user.pk])
+
+
+@override_settings(PASSWORD_RESET_MAX_ATTEMPTS=3)
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        self.client = APIClient()
+
+    def login(self, username, ip='10.0.0.1'):
+        return self.client.post('/login/', {'username': username, 'password': 'wrong'}, REMOTE_ADDR=ip)
+
+    @mock.patch.dict('rest_framework.throttling.SimpleRateThrottle.THROTTLE_RATES',
+                     {'login': '3/min', 'login_account': '2/min'})
+    def test_login_is_limited_per_ip_and_per_account(self):
+        self.assertEqual(self.login('owner').status_code, 401)
+        self.assertEqual(self.login('OWNER ', ip='10.0.0.2').status_code, 401)
+        # третья попытка на тот же аккаунт с другого IP отклоняется до проверки пароля
+        with self.assertNumQueries(0):
+            response = self.login('owner', ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # с одного IP по разным аккаунтам
+        self.assertEqual(self.login('other').status_code, 401)
+        self.assertEqual(self.login('another').status_code, 401)
+        self.assertEqual(self.login('third').status_code, 429)
+        self.assertEqual(self.login('third', ip='10.0.0.4').status_code, 401)
+
+    @mock.patch.dict('rest_framework.throttling.SimpleRateThrottle.THROTTLE_RATES',
+                     {'login': '3/min', 'login_account': '100/min'})
+    def test_forwarded_for_cannot_be_spoofed(self):
+        # nginx дописывает настоящий адрес клиента в конец X-Forwarded-For
+        statuses = [
+            self.client.post('/login/', {'username': f'user{number}', 'password': 'wrong'}, REMOTE_ADDR='172.18.0.5',
+                             HTTP_X_FORWARDED_FOR=f'1.2.3.{number}, 10.0.0.1').status_code
+            for number in range(8)
+        ]
+        self.assertEqual(statuses, [401] * 3 + [429] * 5)
+
+    @mock.patch.dict('rest_framework.throttling.SimpleRateThrottle.THROTTLE_RATES', {'password_reset_account': '1/min'})
+    def test_password_reset_request_is_limited_per_email(self):
+        self.assertEqual(self.client.post('/password_reset/', {'email': self.user.email}).status_code, 200)
+        self.assertEqual(self.client.post('/password_reset/', {'email': self.user.email}).status_code, 429)
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    def verify(self, code):
+        return self.client.post('/password_reset/verify_code/', {
+            'email': self.user.email, 'reset_code': code, 'new_password': 'new-secret-pass-456',
+        })
+
+    def test_reset_code_burns_after_max_attempts(self):
+        ResetPasswordToken.objects.create(user=self.user, key='1234')
+        for code in ('1111', '2222', '3333'):
+            self.assertEqual(self.verify(code).status_code, 400)
+        self.assertFalse(ResetPasswordToken.objects.exists())
+        # даже верный код уже не принимается, а проверка идет без запросов к базе
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify('1234').status_code, 400)
+
+        self.client.post('/password_reset/', {'email': self.user.email})
+        token = ResetPasswordToken.objects.get()
+        self.assertEqual(self.verify(token.key).status_code, 200)
+        self.assertFalse(ResetPasswordToken.objects.exists())
+        self.assertEqual(self.verify(token.key).status_code, 400)
+
+    def test_reset_code_cannot_be_guessed_without_email(self):
+        token = ResetPasswordToken.objects.create(user=self.user, key='1234')
+        for path in ('/password_reset/confirm/', '/password_reset/validate_token/'):
+            for key in ('1111', token.key):
+                response = self.client.post(path, {'token': key, 'password': 'new-secret-pass-456'})
+                self.assertEqual(response.status_code, 404)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('secret-pass-123'))
+        self.assertTrue(ResetPasswordToken.objects.exists())
+
+
+class QueryCountTests(TestCase):
+    """ Количество запросов на endpoint не должно зависеть от объема данных (N+1 ловится здесь) """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        seed_account(cls.user)
+        cls.group = Group.objects.filter(owner=cls.user).first()
+        cls.product = cls.group.products.first()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertMaxQueries(self, limit, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(len(context), limit, f'{url}: {len(context)} запросов\n{queries}')
+
+    def test_group_list(self):
+        self.assertMaxQueries(2, '/group/')
+
+    def test_group_list_filtered(self):
+        self.assertMaxQueries(2, '/group/?size=39,41&price_min=500&search=Модель')
+
+    def test_group_detail(self):
+        self.assertMaxQueries(4, f'/group/{self.group.pk}/')
+
+    def test_product_detail(self):
+        self.assertMaxQueries(3, f'/product/{self.product.pk}/')
+
+    def test_seller_list(self):
+        self.assertMaxQueries(1, '/seller/')
+
+    def test_history(self):
+        self.assertMaxQueries(2, '/history/')
+
+    def test_inventory(self):
+        self.assertMaxQueries(1, '/inventory/')
+
+    def test_history_items(self):
+        self.assertMaxQueries(1, '/history/items/')
+
+    def test_sales_analytics(self):
+        self.assertMaxQueries(1, '/analytics/sales/?period=week')
+
+    def create_product(self, group, sizes):
+        product = Product.objects.create(group=group, product_name='Модель', low_price=1000)
+        self.client.post(f'/product/{product.pk}/size/create/', [{'size': 40, 'quantity': sizes}], format='json')
+        return product
+
+    def count_queries(self, delete):
+        with CaptureQueriesContext(connection) as context:
+            delete()
+        return len(context), '\n'.join(query['sql'] for query in context.captured_queries)
+
+    def test_product_delete_does_not_grow_with_sizes(self):
+        small, big = self.create_product(self.group, 2), self.create_product(self.group, 40)
+
+        small_count, _ = self.count_queries(lambda: self.client.delete(f'/product/{small.pk}/'))
+        big_count, queries = self.count_queries(lambda: self.client.delete(f'/product/{big.pk}/'))
+        self.assertEqual(small_count, big_count, queries)
+        self.assertFalse(Product.objects.filter(pk__in=[small.pk, big.pk]).exists())
+
+    def test_group_delete_does_not_grow_with_sizes(self):
+        groups = []
+        for day, sizes in ((10, 2), (11, 40)):
+            group = Group.objects.create(owner=self.user, group_date=date.today() - timedelta(days=day))
+            self.create_product(group, sizes)
+            self.create_product(group, sizes)
+            groups.append(group)
+
+        small_count, _ = self.count_queries(groups[0].delete)
+        big_count, queries = self.count_queries(groups[1].delete)
+        self.assertEqual(small_count, big_count, queries)
+
+    def test_group_detail_does_not_grow_with_products(self):
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(f'/group/{self.group.pk}/')
+        seed_account(UserProfile.objects.create_user('other', 'other@example.com', 'secret-pass-123'))
+        Product.objects.filter(group=self.group).update(product_name='Новая модель')
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(f'/group/{self.group.pk}/')
+        self.assertEqual(len(before), len(after))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class IndexUsageTests(TestCase):
+    """ Горячие запросы должны идти по индексам, а не полным сканированием таблиц """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create_user('owner', 'owner@example.com', 'secret-pass-123')
+        seed_account(cls.user)
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.query_plan(queryset)
+        self.assertIn(index_name, plan, plan)
+
+    def test_sold_sizes_of_product(self):
+        product = Product.objects.filter(group__owner=self.user).first()
+        self.assertUsesIndex(ProductSize.objects.filter(product=product, have=False), 'productsize_product_have_idx')
+
+    def test_in_stock_size_filter(self):
+        in_stock = ProductSize.objects.filter(size=39, have=True, product__group=OuterRef('pk'))
+        plan = self.query_plan(Group.objects.filter(owner=self.user).filter(Exists(in_stock)))
+        self.assertIn('productsize_in_stock_idx', plan, plan)
+        self.assertNotIn('SCAN richman_productsize', plan)
+
+    def test_history_page(self):
+        items = HistoryItem.objects.filter(history__user=self.user).order_by('-sold_date', '-id')[:50]
+        self.assertUsesIndex(items, 'historyitem_history_sold_idx')
+
+    def test_group_list_etag(self):
+        self.assertUsesIndex(
+            Group.objects.filter(owner=self.user).values('owner').annotate(last=Max('updated_date')),
+            'group_owner_updated_idx',
+        )
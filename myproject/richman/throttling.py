@@ -0,0 +1,69 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django_rest_passwordreset.models import get_password_reset_token_expiry_time
+from rest_framework.throttling import ScopedRateThrottle, SimpleRateThrottle
+
+
+def get_account_ident(value):
+    """ Логин/email приводим к одному виду и хешируем, чтобы в ключ кеша не попадали произвольные строки """
+    return hashlib.md5(str(value).strip().lower().encode()).hexdigest()
+
+
+class IPRateThrottle(ScopedRateThrottle):
+    """ Лимит по IP для view.throttle_scope; ставки — REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].
+    История запросов лежит в кеше (скользящее окно DRF), в базу ничего не пишется """
+
+    def get_cache_key(self, request, view):
+        # на эти endpoint'ы приходят без токена, поэтому всегда считаем по IP
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AccountRateThrottle(ScopedRateThrottle):
+    """ Лимит на аккаунт: ключ — поле view.throttle_account_field из тела запроса, ставка — '<scope>_account'.
+    Перебор пароля одного пользователя с разных IP упирается сюда """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if not scope or not getattr(view, 'throttle_account_field', None):
+            return True
+        self.scope = f'{scope}_account'
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return SimpleRateThrottle.allow_request(self, request, view)
+
+    def get_cache_key(self, request, view):
+        value = request.data.get(view.throttle_account_field) if hasattr(request.data, 'get') else None
+        if not value or not isinstance(value, str):
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': get_account_ident(value)}
+
+
+AUTH_THROTTLE_CLASSES = [IPRateThrottle, AccountRateThrottle]
+
+
+def get_reset_attempts_key(email):
+    return f'richman:reset_attempts:{get_account_ident(email)}'
+
+
+def get_reset_attempts(email):
+    return cache.get(get_reset_attempts_key(email), 0)
+
+
+def add_reset_attempt(email):
+    """ +1 неудачная попытка ввода кода; счетчик живет столько же, сколько код сброса """
+    key = get_reset_attempts_key(email)
+    cache.add(key, 0, get_password_reset_token_expiry_time() * 60 * 60)
+    try:
+        return cache.incr(key)
+    except ValueError:  # ключ успел истечь между add и incr
+        cache.set(key, 1, get_password_reset_token_expiry_time() * 60 * 60)
+        return 1
+
+
+def clear_reset_attempts(email):
+    cache.delete(get_reset_attempts_key(email))
+
+
+def get_reset_max_attempts():
+    return getattr(settings, 'PASSWORD_RESET_MAX_ATTEMPTS', 5)
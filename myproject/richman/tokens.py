@@ -0,0 +1,80 @@
+from datetime import datetime, timezone as dt_timezone
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .cache import bump_version
+from .models import RevokedToken, UserProfile
+
+
+def revocation_key(jti):
+    return f'richman:revoked:{jti}'
+
+
+def get_expires_date(token):
+    return datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+
+
+def get_remaining_seconds(token):
+    return int((get_expires_date(token) - timezone.now()).total_seconds())
+
+
+def revoke_token(token):
+    """ Запоминает jti в кеше на оставшийся срок жизни токена и в базе — чтобы пережить очистку кеша """
+    seconds = get_remaining_seconds(token)
+    if seconds <= 0:
+        return
+    jti = token[api_settings.JTI_CLAIM]
+    RevokedToken.objects.bulk_create([RevokedToken(
+        jti=jti, user_id=token.get(api_settings.USER_ID_CLAIM), expires_date=get_expires_date(token),
+    )], ignore_conflicts=True)
+    cache.set(revocation_key(jti), True, seconds)
+
+
+def is_revoked(token, durable=True):
+    """ durable=False — только кеш: для access-токенов, которые проверяются на каждом запросе и живут 15 минут.
+    Для refresh при промахе кеша смотрим в базу (индекс по jti, строки только неистекших токенов) """
+    jti = token.get(api_settings.JTI_CLAIM)
+    if jti is None:
+        return False
+    if cache.get(revocation_key(jti)):
+        return True
+    if not durable:
+        return False
+    if RevokedToken.objects.filter(jti=jti).exists():
+        cache.set(revocation_key(jti), True, max(get_remaining_seconds(token), 1))
+        return True
+    return False
+
+
+def revoke_access_tokens(user_id):
+    """ Все access-токены пользователя, выданные до этого момента, больше не действуют.
+    Отметка лежит в базе и приходит вместе с пользователем в CachedJWTAuthentication """
+    UserProfile.objects.filter(pk=user_id).update(tokens_revoked_date=timezone.now())
+    # update() идет в обход сигналов: кешированный пользователь со старой отметкой больше не читается
+    bump_version('user', user_id)
+
+
+def is_issued_before_revocation(token, user):
+    revoked_date = getattr(user, 'tokens_revoked_date', None)
+    issued = token.get('iat')
+    if revoked_date is None or issued is None:
+        return False
+    cutoff = int(revoked_date.timestamp())
+    # iat с точностью до секунды: токен, выданный в ту же секунду, что и выход, сверяем по jti
+    return issued < cutoff or (issued == cutoff and is_revoked(token))
+
+
+def purge_expired_tokens():
+    deleted, _ = RevokedToken.objects.filter(expires_date__lt=timezone.now()).delete()
+    return deleted
+
+
+class RevocableRefreshToken(RefreshToken):
+    """ RefreshToken, который не проходит проверку после выхода или ротации """
+
+    def verify(self):
+        super().verify()
+        if is_revoked(self):
+            raise TokenError('Токен отозван')
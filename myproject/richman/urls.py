@@ -1,7 +1,7 @@
 from django.urls import path, include
 from .views import *
 from rest_framework import routers
-from rest_framework_simplejwt.views import TokenRefreshView, TokenObtainPairView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 router = routers.SimpleRouter()
 
@@ -11,9 +11,11 @@ urlpatterns = [
     path('login/', CustomLoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
 
-    path('password_reset/verify_code/', verify_reset_code, name='verify_reset_code'),
-    path('password_reset/', include('django_rest_passwordreset.urls', namespace='password_reset')),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('password_reset/verify_code/', VerifyResetCodeAPIView.as_view(), name='verify_reset_code'),
+    # из django_rest_passwordreset берем только запрос кода: confirm/ и validate_token/ проверяют 4 цифры без email
+    # и без лимита попыток, код подтверждается через verify_code/
+    path('password_reset/', PasswordResetRequestView.as_view(), name='password_reset_request'),
+    path('api/token/', TokenObtainView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     path('user/', UserProfileListAPIView.as_view(), name='user_list'),
@@ -26,16 +28,26 @@ urlpatterns = [
 
     # groups
     path('group/', GroupListAPIView.as_view(), name='group_list'),
+    path('group/export/', GroupExportAPIView.as_view(), name='group_export'),
     path('group/create/', GroupCreateAPIView.as_view(), name='group_create'),
     path('group/<int:pk>/', GroupDetailAPIView.as_view(), name='group_detail'),
 
     # products
     path('group/<int:group_id>/product/create/', ProductCreateAPIView.as_view(), name='product_create'),
+    path('group/<int:group_id>/product/import/', ProductImportAPIView.as_view(), name='product_import'),
+    path('product/search/', ProductSearchAPIView.as_view(), name='product_search'),
     path('product/<int:pk>/', ProductDetailAPIView.as_view(), name='product_edit'),
 
     # sizes
     path('product/<int:product_id>/size/create/', ProductSizeCreateAPIView.as_view(), name='product_size_create'),
+    path('size/sell/', ProductSizeSellAPIView.as_view(), name='product_size_sell'),
     path('size/<int:pk>/', ProductSizeEditAPIView.as_view(), name='product_size_edit'),
 
     path('history/', HistoryAPIView.as_view(), name='history_list'),
+    path('history/items/', HistoryItemListAPIView.as_view(), name='history_item_list'),
+    path('history/export/', HistoryExportAPIView.as_view(), name='history_export'),
+
+    path('inventory/', InventoryAPIView.as_view(), name='inventory'),
+    path('analytics/sales/', SalesAnalyticsAPIView.as_view(), name='sales_analytics'),
+    path('cache/stats/', CacheStatsAPIView.as_view(), name='cache_stats'),
 ]
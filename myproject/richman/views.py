@@ -1,13 +1,26 @@
-from django.db.models import Exists, OuterRef
+import hashlib
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db.models import Count, DateField, F, Max, Prefetch, Sum
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
 from .serializers import *
-from rest_framework import generics, status
+from rest_framework import exceptions, generics, status
 from rest_framework_simplejwt.views import TokenObtainPairView
+from django_rest_passwordreset.views import ResetPasswordRequestToken
 from .filters import *
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from .tokens import RevocableRefreshToken, revoke_access_tokens, revoke_token
+from .throttling import AUTH_THROTTLE_CLASSES
 from .permissions import *
-from rest_framework.decorators import api_view
+from .pagination import *
+from .search import search_product_ids
+from .exports import CHUNK_SIZE, export_response, get_export_type
+from .imports import ImportFileError, import_products, read_rows, validate_rows
+from .cache import CachedResponseMixin, ConditionalGetMixin, get_cache_stats, get_version
 from rest_framework.response import Response
 from .serializers import VerifyResetCodeSerializer
 
@@ -15,6 +28,8 @@ from .serializers import VerifyResetCodeSerializer
 class RegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = AUTH_THROTTLE_CLASSES
+    throttle_scope = 'register'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -26,6 +41,9 @@ class RegisterView(generics.CreateAPIView):
 class CustomLoginView(TokenObtainPairView):
     serializer_class = LoginSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = AUTH_THROTTLE_CLASSES
+    throttle_scope = 'login'
+    throttle_account_field = 'username'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -38,17 +56,34 @@ class CustomLoginView(TokenObtainPairView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class TokenObtainView(TokenObtainPairView):
+    throttle_classes = AUTH_THROTTLE_CLASSES
+    throttle_scope = 'login'
+    throttle_account_field = 'username'
+
+
+class PasswordResetRequestView(ResetPasswordRequestToken):
+    """ Ограничения django_rest_passwordreset не ставит (throttle_classes = ()) """
+    throttle_classes = AUTH_THROTTLE_CLASSES
+    throttle_scope = 'password_reset'
+    throttle_account_field = 'email'
+
+
 class LogoutView(generics.GenericAPIView):
     permission_classes = [permissions.AllowAny]
 
     def post(self, request, *args, **kwargs):
         try:
-            refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
-            token.blacklist()
-            return Response(status=status.HTTP_205_RESET_CONTENT)
-        except Exception:
+            token = RevocableRefreshToken(request.data["refresh"])
+        except (KeyError, TokenError):
             return Response(status=status.HTTP_400_BAD_REQUEST)
+        revoke_token(token)
+        # access-токен из заголовка тоже больше не действует
+        if request.auth is not None:
+            revoke_token(request.auth)
+        # как и все ранее выданные access-токены пользователя: отметка в базе переживает очистку кеша
+        revoke_access_tokens(token[api_settings.USER_ID_CLAIM])
+        return Response(status=status.HTTP_205_RESET_CONTENT)
 
 
 class UserProfileListAPIView(generics.ListAPIView):
@@ -66,48 +101,47 @@ class UserProfileEditAPIView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [CheckUserEdit]
 
 
-class GroupListAPIView(generics.ListAPIView):
+class GroupListAPIView(ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
+    cache_scopes = ('groups',)
     queryset = Group.objects.all()
     serializer_class = GroupListSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['products__sizes__size', 'products__sizes__have']
-    search_fields = ['products__product_name']
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = GroupFilter
     ordering_fields = ['group_date', 'created_date']
+    ordering = ('-group_date', '-id')
+    pagination_class = GroupCursorPagination
 
-    # здесь фильтр по размеру и проверяется have=True
     def get_queryset(self):
-        size_filter = self.request.query_params.get('products__sizes__size')
         if self.request.user.is_authenticated:
-            queryset = Group.objects.filter(owner=self.request.user)
-        else:
-            queryset = Group.objects.none()
-
-        if size_filter:
-            queryset = queryset.filter(
-                Exists(
-                    ProductSize.objects.filter(
-                        size=size_filter,
-                        have=True,
-                        product__group=OuterRef('pk')
-                    )
-                )
-            )
-        return queryset.distinct()
+            return Group.objects.filter(owner=self.request.user)
+        return Group.objects.none()
 
+    def get_last_modified(self, request):
+        # удаление группы не двигает MAX(), поэтому в ETag входит и количество групп
+        state = Group.objects.filter(owner=request.user).aggregate(last=Max('updated_date'), count=Count('pk'))
+        return state['last'], state['count']
 
-class GroupDetailAPIView(generics.RetrieveAPIView):
-    queryset = Group.objects.all().distinct()
+
+class GroupDetailAPIView(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
+    cache_scopes = ('groups',)
+    queryset = Group.objects.all()
     serializer_class = GroupDetailSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     permission_classes = [CheckEdit]
-    filterset_fields = ['products__sizes__size', ]
-    search_fields = ['products__product_name']
-    ordering_fields = ['group_date', 'created_date']
+
+    def get_queryset(self):
+        return Group.objects.with_products().filter(owner=self.request.user)
+
+    def get_last_modified(self, request):
+        # изменения продуктов и размеров поднимают updated_date группы
+        last = Group.objects.filter(pk=self.kwargs['pk'], owner=request.user).values_list('updated_date', flat=True)
+        return (last[0], None) if last else None
 
 
-class SellerListAPIView(generics.ListAPIView):
+class SellerListAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_scopes = ('sellers',)
     queryset = Seller.objects.all()
     serializer_class = SellerNameSerializer
+    pagination_class = SellerCursorPagination
 
     def get_queryset(self):
         return Seller.objects.filter(owner=self.request.user)
@@ -125,6 +159,9 @@ class SellerEditAPIView(generics.RetrieveUpdateAPIView):
     serializer_class = SellerSerializer
     permission_classes = [CheckEdit]
 
+    def get_queryset(self):
+        return Seller.objects.filter(owner=self.request.user)
+
 
 class GroupCreateAPIView(generics.CreateAPIView):
     serializer_class = GroupSerializer
@@ -147,15 +184,93 @@ class ProductCreateAPIView(generics.CreateAPIView):
         serializer.save(group=group)
 
 
-class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ProductImportAPIView(generics.GenericAPIView):
+    """ POST: продукты и размеры в группу из CSV/XLSX (поле file; столбцы product_name, article, low_price, sizes,
+    description). Пока идет импорт, GET отдает его прогресс """
+    parser_classes = [MultiPartParser]
+    max_rows = 5000
+    progress_timeout = 60 * 60
+
+    def get_group(self):
+        group = Group.objects.filter(pk=self.kwargs['group_id'], owner=self.request.user).first()
+        if group is None:
+            raise exceptions.NotFound('Группа не найдена или не принадлежит вам.')
+        return group
+
+    def get_progress_key(self, group):
+        return f'richman:import:{group.owner_id}:{group.pk}'
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache.get(self.get_progress_key(self.get_group())) or {'status': 'none'})
+
+    def post(self, request, *args, **kwargs):
+        group = self.get_group()
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise exceptions.ValidationError({'file': 'Прикрепите файл .csv или .xlsx.'})
+
+        progress_key = self.get_progress_key(group)
+
+        def report(status, **data):
+            cache.set(progress_key, {'status': status, **data}, self.progress_timeout)
+
+        report('validating')
+        try:
+            products = validate_rows(read_rows(upload, upload.name), max_rows=self.max_rows)
+        except ImportFileError as error:
+            report('failed', **error.as_data())
+            return Response(error.as_data(), status=status.HTTP_400_BAD_REQUEST)
+
+        report('importing', total=len(products), imported=0)
+        result = import_products(group, products, progress=lambda done, total: report(
+            'importing', total=total, imported=done
+        ))
+        report('done', total=len(products), imported=len(products), **result)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+
+class ProductDetailAPIView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductDetailSerializer
     permission_classes = [CheckProductEdit]
 
+    def get_queryset(self):
+        # у размеров из prefetch уже есть ссылка на продукт: get_profit не делает запрос на каждый размер
+        return Product.objects.filter(group__owner=self.request.user).select_related('group').prefetch_related('sizes')
+
+    def get_last_modified(self, request):
+        last = Product.objects.filter(
+            pk=self.kwargs['pk'], group__owner=request.user
+        ).values_list('updated_date', flat=True)
+        return (last[0], None) if last else None
+
+
+class ProductSearchAPIView(generics.ListAPIView):
+    """ Полнотекстовый поиск по названию, артикулу и описанию продуктов пользователя: ?q=... """
+    serializer_class = ProductSearchSerializer
+    pagination_class = ProductSearchPagination
+
+    def list(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '')
+        if len(text) > 100:
+            raise exceptions.ValidationError({'q': 'Слишком длинный запрос'})
+        # пагинируем список id по релевантности, а продукты читаем только для текущей страницы
+        page = self.paginate_queryset(search_product_ids(request.user.id, text))
+        products = Product.objects.filter(group__owner=request.user).select_related('group').in_bulk(page)
+        serializer = self.get_serializer([products[pk] for pk in page if pk in products], many=True)
+        return self.get_paginated_response(serializer.data)
+
 
 class ProductSizeCreateAPIView(generics.CreateAPIView):
     serializer_class = ProductSizeSerializer
 
+    def get_serializer(self, *args, **kwargs):
+        # список размеров (поставка) проверяется вместе и создается одним bulk_create
+        if isinstance(kwargs.get('data'), list):
+            kwargs.setdefault('context', self.get_serializer_context())
+            return ProductSizeBulkSerializer(*args, many=True, allow_empty=False, **kwargs)
+        return super().get_serializer(*args, **kwargs)
+
     def perform_create(self, serializer):
         product_id = self.kwargs.get('product_id')  # Получаем ID группы из URL
         product = Product.objects.filter(id=product_id, group__owner=self.request.user).first()
@@ -172,8 +287,21 @@ class ProductSizeEditAPIView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProductSizeSerializer
     permission_classes = [CheckProductSizeEdit]
 
+    def get_queryset(self):
+        return ProductSize.objects.filter(product__group__owner=self.request.user).select_related('product__group')
+
+
+class ProductSizeSellAPIView(generics.GenericAPIView):
+    serializer_class = ProductSizeSellSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_200_OK)
+
 
-class HistoryAPIView(generics.ListAPIView):
+class HistoryAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_scopes = ('history',)
     queryset = History.objects.all()
     serializer_class = HistorySerializer
 
@@ -181,13 +309,171 @@ class HistoryAPIView(generics.ListAPIView):
     # filterset_class = SalesHistoryFilter
 
     def get_queryset(self):
-        return History.objects.filter(user=self.request.user)
+        return History.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('history_items', queryset=HistoryItem.objects.select_related(
+                'product', 'product_size', 'product_size__seller'
+            ))
+        )
+
+
+class HistoryItemListAPIView(generics.ListAPIView):
+    serializer_class = HistoryItemSerializer
+    pagination_class = HistoryItemCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SalesHistoryFilter
+
+    def get_queryset(self):
+        return HistoryItem.objects.filter(history__user=self.request.user).select_related(
+            'product', 'product_size', 'product_size__seller'
+        )
+
 
+class HistoryExportAPIView(generics.GenericAPIView):
+    """ Вся история продаж файлом (?type=csv|xlsx) с теми же фильтрами, что и /history/items/ """
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SalesHistoryFilter
+    header = ['Дата продажи', 'Продукт', 'Артикул', 'Размер', 'Закупка', 'Продажа', 'Прибыль', 'Продавец']
+
+    def get_queryset(self):
+        return HistoryItem.objects.filter(history__user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        export_type = get_export_type(request)
+        # values_list вместо объектов: те же join'ы, что у select_related, но без создания моделей на каждую строку
+        rows = self.filter_queryset(self.get_queryset()).order_by('-sold_date', '-id').values_list(
+            'sold_date', 'product__product_name', 'product__article', 'product_size__size', 'product__low_price',
+            'product_size__high_price', 'product_size__seller__seller_name',
+        )
+        return export_response(export_type, 'history', self.header, (
+            [timezone.localtime(sold_date).replace(tzinfo=None), name, article, size, low_price, high_price,
+             high_price - low_price if high_price is not None else None, seller]
+            for sold_date, name, article, size, low_price, high_price, seller in rows.iterator(chunk_size=CHUNK_SIZE)
+        ), 'История продаж')
+
+
+class GroupExportAPIView(generics.GenericAPIView):
+    """ Отчет по группам (итоги из столбцов групп) файлом; фильтры /group/ и group_date__gte/lte """
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = GroupReportFilter
+    header = ['Дата группы', 'Продуктов', 'Продано', 'В наличии', 'Закупка', 'Выручка', 'Прибыль']
 
-@api_view(['POST'])
-def verify_reset_code(request):
-    serializer = VerifyResetCodeSerializer(data=request.data)
-    if serializer.is_valid():
-        serializer.save()
-        return Response({'message': 'Пароль успешно сброшен.'}, status=status.HTTP_200_OK)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    def get_queryset(self):
+        return Group.objects.filter(owner=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        export_type = get_export_type(request)
+        rows = self.filter_queryset(self.get_queryset()).order_by('-group_date').values_list(
+            'group_date', 'products_count', 'sold_count', 'stock_count', 'spend', 'income', 'profit',
+        )
+        return export_response(export_type, 'groups', self.header, rows.iterator(chunk_size=CHUNK_SIZE),
+                               'Группы')
+
+
+class SalesAnalyticsAPIView(generics.GenericAPIView):
+    serializer_class = SalesAnalyticsSerializer
+    periods = ('day', 'week', 'month')
+    cache_timeout = 60 * 60 * 24
+
+    def get_queryset(self):
+        return HistoryItem.objects.filter(history__user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        period = request.query_params.get('period', 'day')
+        if period not in self.periods:
+            raise exceptions.ValidationError({'period': f'Допустимые значения: {", ".join(self.periods)}.'})
+
+        filterset = SalesHistoryFilter(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise exceptions.ValidationError(filterset.errors)
+
+        # закрытый период (до вчерашнего дня включительно) меняется только вместе с историей,
+        # поэтому кешируем его по версии истории; текущий день всегда считаем заново
+        cache_key = None
+        date_to = filterset.form.cleaned_data.get('sold_date__lte')
+        if date_to and date_to < timezone.localdate():
+            params = hashlib.md5(urlencode(sorted(request.query_params.items())).encode()).hexdigest()
+            cache_key = f'richman:analytics:{request.user.id}:{get_version("history", request.user.id)}:{params}'
+            data = cache.get(cache_key)
+            if data is not None:
+                return Response(data)
+
+        buckets = (
+            filterset.qs
+            .annotate(period=Trunc('sold_date', period, output_field=DateField()))
+            .values('period')
+            .annotate(
+                units=Count('pk'),
+                income=Coalesce(Sum('product_size__high_price'), 0),
+                cost=Coalesce(Sum('product__low_price'), 0),
+            )
+            .annotate(profit=F('income') - F('cost'))
+            .order_by('period')
+        )
+        data = self.get_serializer(buckets, many=True).data
+        if cache_key:
+            cache.set(cache_key, data, self.cache_timeout)
+        return Response(data)
+
+
+class InventoryAPIView(CachedResponseMixin, generics.GenericAPIView):
+    """ Сколько размеров в наличии: всего, по каждому размеру и по артикулу (или названию, если артикула нет) """
+    cache_scopes = ('groups',)
+    serializer_class = InventorySerializer
+
+    def get_queryset(self):
+        return ProductSize.objects.filter(have=True, product__group__owner=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        filterset = InventoryFilter(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise exceptions.ValidationError(filterset.errors)
+
+        # один GROUP BY по (артикул, название, размер), остальное сворачиваем в Python:
+        # строк в ответе базы столько, сколько разных пар артикул/размер, а не размеров
+        rows = (
+            filterset.qs
+            .values('product__article', 'product__product_name', 'size')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+        sizes, products = {}, {}
+        for row in rows:
+            sizes[row['size']] = sizes.get(row['size'], 0) + row['count']
+            key = row['product__article'] or row['product__product_name']
+            product = products.setdefault(key, {
+                'article': row['product__article'], 'product_name': row['product__product_name'],
+                'count': 0, 'sizes': {},
+            })
+            product['count'] += row['count']
+            product['sizes'][row['size']] = product['sizes'].get(row['size'], 0) + row['count']
+
+        for product in products.values():
+            product['sizes'] = [{'size': size, 'count': count} for size, count in sorted(product['sizes'].items())]
+        data = {
+            'count': sum(sizes.values()),
+            'sizes': [{'size': size, 'count': count} for size, count in sorted(sizes.items())],
+            'products': sorted(products.values(), key=lambda product: (product['product_name'], product['article'] or '')),
+        }
+        return Response(self.get_serializer(data).data)
+
+
+class CacheStatsAPIView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_cache_stats(sorted(CachedResponseMixin.cached_views)))
+
+
+class VerifyResetCodeAPIView(generics.GenericAPIView):
+    serializer_class = VerifyResetCodeSerializer
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = AUTH_THROTTLE_CLASSES
+    throttle_scope = 'verify_reset_code'
+    throttle_account_field = 'email'
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response({'message': 'Пароль успешно сброшен.'}, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)